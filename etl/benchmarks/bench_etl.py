@@ -0,0 +1,246 @@
+"""Бенчмарк ETL целиком: полная загрузка и инкрементальный проход на каталоге из benchmarks.catalogue.
+
+Сценарии:
+    full         - run_etl_initial_load: новый индекс, загрузка партиций, догрузка и переключение алиаса,
+                   затем перестройка производных индексов (extra_indices);
+    incremental  - после полной загрузки у случайных фильмов и персон обновляется modified
+                   и замеряется один проход sync_changes (новые фильмы и переиндексация по зависимостям).
+
+По умолчанию вместо Elasticsearch работает benchmarks.fake_elasticsearch: он принимает _bulk,
+ничего не индексируя, и замер показывает стоимость самого ETL. С --elastic замер идёт на настоящем
+кластере (например, из docker-compose); к алиасам movies, genres и persons добавляется --index-prefix,
+чтобы не задеть рабочие индексы.
+
+ВНИМАНИЕ: база должна быть отдельной - --generate пересоздаёт content.*, incremental меняет modified.
+
+Запуск из каталога etl:
+    python -m benchmarks.bench_etl --dsn postgresql://... --generate --films 100000
+    python -m benchmarks.bench_etl --dsn postgresql://... --scenario incremental --touch-films 1000 --touch-persons 10
+    python -m benchmarks.bench_etl --dsn postgresql://... --elastic http://localhost:9200 --output results.jsonl
+    python -m benchmarks.bench_etl --dsn postgresql://... --set ndjson_fast_path=false --set batch_size=500
+
+Каждый сценарий печатает одну строку JSON (и дописывает её в --output): коммит, параметры, документы
+в секунду, пик RSS и p50/p99 длительности пачки по этапам (extract, transform, bulk, reindex).
+Длительности этапов собираются в этом процессе, поэтому при full_load_workers > 1 этапы партиций
+в них не попадают. Строки разных коммитов на одном каталоге сравнимы между собой.
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import subprocess
+import tempfile
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import psycopg2
+
+from etl.config import settings
+from etl.extractor import PostgresExtractor
+from etl.hash_store import DocumentHashStore
+from etl.loader import ElasticLoader
+from etl.main import run_etl_initial_load, sync_changes
+from etl.metrics import collect_stage_samples
+from etl.migrate import apply_migrations
+from etl.state import State
+from etl.targets import index_targets
+from benchmarks.catalogue import Catalogue, generate_catalogue
+from benchmarks.fake_elasticsearch import running_fake_elasticsearch
+
+# Случайная, но воспроизводимая выборка строк: порядок md5(id || seed)
+TOUCH_QUERY = """
+UPDATE content.{table} SET modified = now()
+WHERE id IN (SELECT id FROM content.{table} ORDER BY md5(id::text || %s) LIMIT %s);
+"""
+# Настройки, которые попадают в результат: от них зависит сравнимость замеров
+REPORTED_SETTINGS = (
+    "batch_size", "bulk_chunk_size", "bulk_workers", "full_load_workers", "adaptive_batching",
+    "ndjson_fast_path", "es_http_compress", "skip_unchanged", "extra_indices", "dimension_cache",
+)
+
+def configure(overrides: Dict[str, Any]):
+    """Меняет настройки ETL в этом процессе и в окружении: процессы партиций (spawn) читают его заново."""
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+        os.environ[name.upper()] = str(value).lower() if isinstance(value, bool) else str(value)
+
+def parse_setting(assignment: str) -> Dict[str, Any]:
+    """'имя=значение' из --set с приведением к типу текущего значения настройки."""
+    name, _, value = assignment.partition("=")
+    if not hasattr(settings, name):
+        raise argparse.ArgumentTypeError(f"unknown setting {name!r}")
+    current = getattr(settings, name)
+    if isinstance(current, bool):
+        return {name: value.strip().lower() in ("1", "true", "yes")}
+    return {name: type(current)(value)}
+
+def git_revision() -> Dict[str, Any]:
+    """Коммит рабочей копии и признак незакоммиченных изменений (None вне git)."""
+    directory = Path(__file__).resolve().parent
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=directory, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=directory, capture_output=True, text=True, check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": bool(status.strip())}
+
+def reset_peak_rss():
+    """Сбрасывает пик RSS процесса, чтобы сценарии мерились по отдельности (только Linux)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def peak_rss_mb() -> float:
+    """Пик RSS процесса: VmHWM после reset_peak_rss, иначе ru_maxrss за всё время процесса."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # ru_maxrss в Linux - в килобайтах
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль методом ближайшего ранга по отсортированным значениям."""
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+def stage_summary(samples: Dict[str, List[float]]) -> Dict[str, Dict[str, Any]]:
+    summary = {}
+    for stage, values in sorted(samples.items()):
+        values = sorted(values)
+        summary[stage] = {
+            "batches": len(values),
+            "p50_ms": round(percentile(values, 0.5) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+            "total_seconds": round(sum(values), 3),
+        }
+    return summary
+
+def measure(scenario: str, run: Callable[[], int]) -> Dict[str, Any]:
+    """Выполняет сценарий и собирает его показатели; run возвращает число обработанных документов."""
+    samples = collect_stage_samples()
+    reset_peak_rss()
+    started = time.perf_counter()
+    documents = run()
+    seconds = time.perf_counter() - started
+    return {
+        "scenario": scenario,
+        "documents": documents,
+        "seconds": round(seconds, 3),
+        "docs_per_sec": round(documents / seconds) if seconds else None,
+        "peak_rss_mb": peak_rss_mb(),
+        # Максимум по завершённым дочерним процессам - партициям полной загрузки
+        "children_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        "stages": stage_summary(samples),
+    }
+
+def touch(dsn: str, table: str, count: int, seed: int):
+    """Обновляет modified у count случайных строк content.<table>, как это сделало бы приложение."""
+    if count <= 0:
+        return
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(TOUCH_QUERY.format(table=table), (str(seed), count))
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="отдельная база с каталогом (см. benchmarks.catalogue)")
+    parser.add_argument("--generate", action="store_true", help="пересоздать каталог перед замером")
+    parser.add_argument("--films", type=int, default=10000, help="размер каталога для --generate")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--elastic", help="URL настоящего кластера; по умолчанию - поддельный _bulk")
+    parser.add_argument("--index-prefix", default="bench_", help="префикс алиасов индексов бенчмарка")
+    parser.add_argument("--scenario", choices=("full", "incremental", "all"), default="all")
+    parser.add_argument("--workers", type=int, default=1, help="full_load_workers")
+    parser.add_argument("--touch-films", type=int, default=1000)
+    parser.add_argument("--touch-persons", type=int, default=10)
+    parser.add_argument("--set", dest="overrides", type=parse_setting, action="append", default=[],
+                        metavar="NAME=VALUE", help="изменить настройку ETL (можно повторять)")
+    parser.add_argument("--output", help="дописать строки JSON в этот файл")
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_catalogue(args.dsn, Catalogue(args.films, seed=args.seed))
+    else:
+        apply_migrations(args.dsn)
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench_etl_") as workdir, \
+            (nullcontext(args.elastic) if args.elastic else running_fake_elasticsearch()) as elastic_host:
+        overrides = {
+            "postgres_dsn": args.dsn,
+            "elastic_host": elastic_host,
+            "elastic_index": f"{args.index_prefix}movies",
+            "genres_index": f"{args.index_prefix}genres",
+            "persons_index": f"{args.index_prefix}persons",
+            "full_load_workers": args.workers,
+            # Состояние, хеши и очередь недоставленных - только этого запуска
+            "state_file_path": os.path.join(workdir, "state.json"),
+            "hash_store_path": os.path.join(workdir, "hashes.sqlite3"),
+            "dead_letter_path": os.path.join(workdir, "dead_letters.sqlite3"),
+            "metrics_port": 0,
+            "profile_output": "",
+        }
+        for override in args.overrides:
+            overrides.update(override)
+        configure(overrides)
+
+        extractor = PostgresExtractor()
+        films = extractor.count_films()
+        extractor.close()
+
+        def full_load() -> int:
+            run_etl_initial_load()
+            return films
+
+        def incremental() -> int:
+            extractor = PostgresExtractor()
+            hash_store = DocumentHashStore() if settings.skip_unchanged else None
+            try:
+                return sync_changes(extractor, ElasticLoader(), State(), hash_store, index_targets())
+            finally:
+                extractor.close()
+                if hash_store is not None:
+                    hash_store.close()
+
+        # Инкрементальному проходу нужны индекс и курсоры полной загрузки
+        if args.scenario == "incremental":
+            run_etl_initial_load()
+        else:
+            results.append(measure("full", full_load))
+        if args.scenario != "full":
+            touch(args.dsn, "film_work", args.touch_films, args.seed)
+            touch(args.dsn, "person", args.touch_persons, args.seed)
+            results.append(measure("incremental", incremental))
+
+    common = {
+        "benchmark": "etl",
+        **git_revision(),
+        "elastic": args.elastic or "fake",
+        "films": films,
+        "touch_films": args.touch_films,
+        "touch_persons": args.touch_persons,
+        "settings": {name: getattr(settings, name) for name in REPORTED_SETTINGS},
+    }
+    lines = [json.dumps({**common, **result}) for result in results]
+    for line in lines:
+        print(line)
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write("".join(line + "\n" for line in lines))
+
+if __name__ == "__main__":
+    main()
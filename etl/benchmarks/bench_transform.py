@@ -0,0 +1,338 @@
+"""Микробенчмарк сборки документов movies против исходной реализации transform_movies.
+
+Исходная версия разбирала строки 'id###name' и очищала 'N/A'/'None' в Python; теперь это делает
+FILMWORK_SELECT, а transform_movies только собирает документ. Бенчмарк сравнивает оба пути
+на одних и тех же фильмах и проверяет, что документы совпадают.
+
+Запуск из каталога etl:
+    python -m benchmarks.bench_transform [--rows N] [--repeat N]
+    python -m benchmarks.bench_transform --dsn postgresql://... [--rows N]
+
+Без --dsn строки обоих запросов моделируются на синтетическом каталоге; с --dsn оба запроса
+выполняются на реальной базе. Кроме самой сборки документов замеряется и путь целиком: разбор
+колонок драйвером (text[] исходного запроса - приведением типов psycopg2, json текущего - orjson)
+плюс сборка, одинаково для обоих путей. Результат печатается одной строкой JSON; при расхождении
+документов бенчмарк завершается с ошибкой.
+"""
+import argparse
+import gc
+import json
+import random
+import time
+import uuid
+from typing import List, Dict, Any, Optional, Tuple
+
+import orjson
+from psycopg2.extensions import STRINGARRAY
+
+from etl.transformer import transform_movies
+
+# --- Исходная реализация (до оптимизации), эталон для сравнения результата и скорости ---
+
+def reference_clean_value(value: Any) -> Optional[str]:
+    """Очищает значение: приводит к строке и заменяет 'N/A' и 'None' на None."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        if value.strip() == "N/A" or value.strip() == "None":
+            return None
+        return value.strip()
+    # Если значение не строка, попробуем привести к строке
+    try:
+        str_val = str(value)
+        if str_val.strip() == "N/A" or str_val.strip() == "None":
+            return None
+        return str_val.strip()
+    except:
+        return None
+
+def reference_parse_person_list(raw_list: Any) -> List[Dict[str, str]]:
+    """Парсит список персонажей из формата 'id###name'. Возвращает список словарей."""
+    # Убедимся, что raw_list - это список
+    if not raw_list or not isinstance(raw_list, list):
+        return []
+
+    persons = []
+    for item in raw_list:
+        # Проверим, что элемент - строка
+        if not item or not isinstance(item, str):
+            continue
+        item_str = reference_clean_value(item)
+        if not item_str:
+            continue
+        parts = item_str.split("###", 2)
+        if len(parts) == 2:
+            pid, name = parts
+            name_clean = reference_clean_value(name)
+            if name_clean:  # Только если имя не N/A, не 'None' и не пустое
+                persons.append({"id": pid.strip(), "name": name_clean})
+    return persons
+
+def reference_transform_movies(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    movies = []
+    for row in rows:
+        # Парсим персонажей
+        # parse_person_list гарантирует возврат списка
+        actors = reference_parse_person_list(row.get("actors"))
+        writers = reference_parse_person_list(row.get("writers"))
+        directors = reference_parse_person_list(row.get("directors"))
+
+        # Обрабатываем жанры: оставляем только не-null, не-N/A, не-'None' строки
+        genres_raw = row.get("genres") or []
+        genres = []
+        for g in genres_raw:
+            g_clean = reference_clean_value(g)
+            if g_clean is not None:
+                genres.append(g_clean)
+
+        # Очищаем title и description
+        title = reference_clean_value(row.get("title"))
+        description = reference_clean_value(row.get("description"))
+
+        # imdb_rating: преобразуем в float, если возможно, иначе None
+        imdb_rating = None
+        rating_val = row.get("imdb_rating")
+        if rating_val is not None:
+            # Проверим, может ли строка быть преобразована в float
+            try:
+                # Явно приведем к float, если возможно
+                val = float(rating_val)
+                # Убедимся, что значение не NaN и не infinity
+                if not (val != val or val == float('inf') or val == float('-inf')):
+                    imdb_rating = val
+            except (ValueError, TypeError):
+                # Если не получилось, оставим None
+                imdb_rating = None
+
+        # Формируем итоговый документ
+        movie = {
+            "id": str(row["id"]),  #id строка
+            "imdb_rating": imdb_rating,
+            "genres": genres, # genres - всегда список строк
+            "title": title,
+            "description": description,
+            "directors_names": [p["name"] for p in directors], # directors_names - всегда список строк
+            "actors_names": [p["name"] for p in actors], # actors_names - всегда список строк
+            "writers_names": [p["name"] for p in writers], # writers_names - всегда список строк
+            "directors": directors, # directors - всегда список объектов {"id": "...", "name": "..."}
+            "actors": actors, # actors - всегда список объектов {"id": "...", "name": "..."}
+            "writers": writers, # writers - всегда список объектов {"id": "...", "name": "..."}
+        }
+
+        movies.append(movie)
+
+    return movies
+
+# Исходный запрос: участники агрегируются строками 'id###name' через соединение с GROUP BY
+LEGACY_FILMWORK_QUERY = """
+SELECT
+    fw.id,
+    fw.title,
+    fw.description,
+    fw.rating AS imdb_rating,
+    fw.modified AS modified,
+    ARRAY_AGG(DISTINCT g.name) FILTER (WHERE g.name IS NOT NULL) AS genres,
+    ARRAY_AGG(DISTINCT p.id || '###' || p.full_name) FILTER (WHERE pfw.role = 'actor' AND p.full_name IS NOT NULL) AS actors,
+    ARRAY_AGG(DISTINCT p.id || '###' || p.full_name) FILTER (WHERE pfw.role = 'writer' AND p.full_name IS NOT NULL) AS writers,
+    ARRAY_AGG(DISTINCT p.id || '###' || p.full_name) FILTER (WHERE pfw.role = 'director' AND p.full_name IS NOT NULL) AS directors
+FROM content."film_work" fw
+LEFT JOIN content."genre_film_work" gfw ON fw.id = gfw.film_work_id
+LEFT JOIN content."genre" g ON gfw.genre_id = g.id
+LEFT JOIN content."person_film_work" pfw ON fw.id = pfw.film_work_id
+LEFT JOIN content."person" p ON pfw.person_id = p.id
+WHERE fw.modified IS NOT NULL
+GROUP BY fw.id
+ORDER BY fw.id;
+"""
+
+# --- Синтетический каталог и модели результатов обоих запросов ---
+
+ROLES = ("actor", "writer", "director")
+NULL_STRINGS = ("N/A", "None")
+
+def generate_films(count: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """Фильмы с участниками (id, full_name, role) и названиями жанров, включая «грязные» значения."""
+    rnd = random.Random(seed)
+    people = [(str(uuid.UUID(int=rnd.getrandbits(128))), f"Person {i}") for i in range(5000)]
+    odd_names = ["N/A", "None", " None ", " ", "", "Padded Name  ", "\u3000Wide Space", "Has###Hash", "#Sharp", "Tab\tInside"]
+    people += [(str(uuid.UUID(int=rnd.getrandbits(128))), name) for name in odd_names]
+    genres = ["Action", "Comedy", "Drama", " Sci-Fi ", "N/A", "None", "Documentary", "", "Drama "]
+    films = []
+    for _ in range(count):
+        # Скошенное распределение размера состава: большинство фильмов небольшие, немногие огромные
+        cast = min(int(rnd.paretovariate(1.2) * 3), 400)
+        credits = []
+        for role, size in (("actor", cast), ("writer", rnd.randint(0, 3)), ("director", rnd.randint(0, 2))):
+            credits.extend((pid, name, role) for pid, name in rnd.sample(people, size))
+        films.append({
+            "id": str(uuid.UUID(int=rnd.getrandbits(128))),
+            "title": rnd.choice(["Star Wars", " Padded title ", "N/A", "None", ""]),
+            "description": rnd.choice([None, "Some description", "N/A", "  text  "]),
+            "rating": rnd.choice([None, 7.5, 8.1, float("nan"), float("inf"), 5.0]),
+            "genres": rnd.sample(genres, rnd.randint(0, 3)),
+            "credits": credits,
+        })
+    return films
+
+def _fresh(value: Any) -> Any:
+    """Копия строки: драйвер создаёт новые объекты строк для каждой строки результата."""
+    return (value + " ")[:-1] if isinstance(value, str) else value
+
+# Колонки text[] исходного запроса: их разбирает драйвер
+ARRAY_COLUMNS = ("genres", "actors", "writers", "directors")
+
+def array_literal(items: List[str]) -> str:
+    """Текстовая запись text[], в которой Postgres отдаёт массив драйверу."""
+    return "{" + ",".join('"' + item.replace("\\", "\\\\").replace('"', '\\"') + '"' for item in items) + "}"
+
+def legacy_row(film: Dict[str, Any]) -> Dict[str, Any]:
+    """Строка LEGACY_FILMWORK_QUERY до разбора массивов драйвером."""
+    genres = sorted(set(film["genres"]))
+    row = {
+        "id": film["id"],
+        "title": _fresh(film["title"]),
+        "description": _fresh(film["description"]),
+        "imdb_rating": film["rating"],
+        "modified": None,
+        "genres": array_literal(genres) if genres else None,
+    }
+    for role in ROLES:
+        items = sorted({f"{pid}###{name}" for pid, name, credit_role in film["credits"] if credit_role == role})
+        row[f"{role}s"] = array_literal(items) if items else None
+    return row
+
+def _clean(value: Optional[str]) -> Optional[str]:
+    # NULLIF(NULLIF(btrim(value), 'N/A'), 'None')
+    if value is None:
+        return None
+    value = value.strip()
+    return None if value in NULL_STRINGS else value
+
+def current_row(film: Dict[str, Any]) -> Dict[str, Any]:
+    """Строка FILMWORK_SELECT до декодирования json: правила очистки повторяют SQL, а не старый Python-код."""
+    rating = film["rating"]
+    row = {
+        "id": film["id"],
+        "title": _clean(film["title"]),
+        "description": _clean(film["description"]),
+        "imdb_rating": None if rating is None or rating != rating or rating in (float("inf"), float("-inf")) else rating,
+        "modified": None,
+        "genres": [g.strip() for g in sorted(set(film["genres"])) if _clean(g) is not None],
+    }
+    for role in ROLES:
+        credits = sorted(
+            (pid + "###" + name, pid, name) for pid, name, credit_role in film["credits"]
+            if credit_role == role and _clean(name) and "###" not in name
+        )
+        row[f"{role}s"] = json.dumps([{"id": pid, "name": name.strip()} for _, pid, name in credits], ensure_ascii=False)
+    return row
+
+def decode_legacy(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Разбор text[] тем же приведением типов, что применяет psycopg2 к строкам исходного запроса."""
+    for row in rows:
+        for column in ARRAY_COLUMNS:
+            row[column] = STRINGARRAY(row[column], None)
+    return rows
+
+def decode(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Декодирование json-колонок, которое делает psycopg2 с зарегистрированным orjson.loads."""
+    loads = orjson.loads
+    for row in rows:
+        row["actors"] = loads(row["actors"])
+        row["writers"] = loads(row["writers"])
+        row["directors"] = loads(row["directors"])
+    return rows
+
+def fetch_rows(dsn: str, limit: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Строки исходного и текущего запросов из реальной базы, упорядоченные по id."""
+    import psycopg2
+    from psycopg2.extras import RealDictCursor, register_default_json
+    from etl.queries import STREAM_FILMWORK_PARTITION_QUERY
+
+    with psycopg2.connect(dsn) as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # Массивы читаем как текст, чтобы их разбор драйвером попал в замер
+            cur.execute(
+                "SELECT id, title, description, imdb_rating, modified, "
+                + ", ".join(f"{column}::text AS {column}" for column in ARRAY_COLUMNS)
+                + " FROM (" + LEGACY_FILMWORK_QUERY.strip().rstrip(";") + ") l ORDER BY id;"
+            )
+            legacy = cur.fetchmany(limit)
+        # Текущий запрос читаем как текст, чтобы декодирование json попало в замер
+        register_default_json(conn, loads=lambda value: value)
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(STREAM_FILMWORK_PARTITION_QUERY, ("00000000-0000-0000-0000-000000000000", "ffffffff-ffff-ffff-ffff-ffffffffffff"))
+            current = cur.fetchmany(limit)
+    return [dict(row) for row in legacy], [dict(row) for row in current]
+
+def measure(cases: List[Tuple[Any, Any]], repeat: int) -> List[float]:
+    """Лучшее время каждой пары (подготовка, замер); подготовка в замер не входит.
+
+    Запуски чередуются, чтобы фоновая нагрузка влияла на все варианты одинаково.
+    """
+    best = [float("inf")] * len(cases)
+    for _ in range(repeat):
+        for position, (setup, func) in enumerate(cases):
+            data = setup()
+            # Как и timeit, отключаем сборщик мусора на время замера
+            gc.collect()
+            gc.disable()
+            try:
+                started = time.perf_counter()
+                func(data)
+                best[position] = min(best[position], time.perf_counter() - started)
+            finally:
+                gc.enable()
+    return best
+
+def batched(rows: List[Dict[str, Any]], size: int) -> List[List[Dict[str, Any]]]:
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--dsn", help="выполнить оба запроса на реальной базе вместо синтетического каталога")
+    args = parser.parse_args()
+
+    if args.dsn:
+        legacy_rows, encoded_rows = fetch_rows(args.dsn, args.rows)
+    else:
+        films = generate_films(args.rows)
+        legacy_rows = [legacy_row(film) for film in films]
+        encoded_rows = [current_row(film) for film in films]
+    encoded_legacy_batches = batched(legacy_rows, args.batch_size)
+    encoded_batches = batched(encoded_rows, args.batch_size)
+    legacy_batches = [decode_legacy([dict(row) for row in batch]) for batch in encoded_legacy_batches]
+    current_batches = [decode([dict(row) for row in batch]) for batch in encoded_batches]
+
+    expected = [doc for batch in legacy_batches for doc in reference_transform_movies(batch)]
+    actual = [doc for batch in current_batches for doc in transform_movies(batch)]
+    if expected != actual:
+        raise SystemExit("transform_movies output differs from the reference implementation")
+
+    reference_seconds, transform_seconds, reference_total_seconds, total_seconds = measure([
+        (lambda: legacy_batches, lambda batches: [reference_transform_movies(batch) for batch in batches]),
+        (lambda: current_batches, lambda batches: [transform_movies(batch) for batch in batches]),
+        (lambda: [[dict(row) for row in batch] for batch in encoded_legacy_batches],
+         lambda batches: [reference_transform_movies(decode_legacy(batch)) for batch in batches]),
+        (lambda: [[dict(row) for row in batch] for batch in encoded_batches],
+         lambda batches: [transform_movies(decode(batch)) for batch in batches]),
+    ], args.repeat)
+    rows = len(legacy_rows)
+    print(json.dumps({
+        "benchmark": "transform_movies",
+        "source": "postgres" if args.dsn else "synthetic",
+        "rows": rows,
+        "batch_size": args.batch_size,
+        "reference_rows_per_sec": round(rows / reference_seconds),
+        "transform_rows_per_sec": round(rows / transform_seconds),
+        "reference_decode_and_transform_rows_per_sec": round(rows / reference_total_seconds),
+        "decode_and_transform_rows_per_sec": round(rows / total_seconds),
+        "transform_speedup": round(reference_seconds / transform_seconds, 2),
+        "decode_and_transform_speedup": round(reference_total_seconds / total_seconds, 2),
+    }))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""Синтетический каталог content.* для бенчмарков ETL.
+
+Схема берётся из database_dump.sql (таблицы, первичные ключи, индексы и внешние ключи схемы content),
+данные генерируются детерминированно по seed. Пропорции как в дампе: около 4 персон и 2 жанров на фильм.
+Размер состава скошен (распределение Парето): большинство фильмов небольшие, единицы - с сотнями
+участников. Популярность персон тоже скошена: изменение «звезды» затрагивает тысячи фильмов.
+
+ВНИМАНИЕ: генерация удаляет и создаёт заново таблицы content.* - используйте отдельную базу.
+
+Запуск из каталога etl:
+    python -m benchmarks.catalogue --dsn postgresql://... --films 100000 [--seed 42]
+
+Строки передаются в COPY потоком и не накапливаются в памяти, так что память не растёт с размером
+каталога (10M фильмов генерируются порядка получаса). Ключи и индексы строятся после загрузки данных,
+затем применяются миграции etl/migrations. Результат печатается одной строкой JSON.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import random
+import time
+from datetime import date, datetime, timedelta
+from itertools import islice
+from pathlib import Path
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+
+import psycopg2
+
+from etl.migrate import apply_migrations
+
+logger = logging.getLogger(__name__)
+
+DUMP_PATH = Path(__file__).resolve().parent.parent / "database_dump.sql"
+TABLES = ("person_film_work", "genre_film_work", "film_work", "person", "genre")
+
+GENRES = (
+    "Action", "Adventure", "Fantasy", "Sci-Fi", "Drama", "Music", "Romance", "Thriller", "Mystery", "Comedy",
+    "Animation", "Family", "Biography", "Musical", "Crime", "Short", "Western", "Documentary", "History", "War",
+    "Game-Show", "Reality-TV", "Horror", "Sport", "Talk-Show", "News",
+)
+WORDS = (
+    "galaxy", "rebel", "empire", "droid", "planet", "journey", "secret", "hero", "battle", "city", "night",
+    "love", "family", "war", "future", "ancient", "lost", "dark", "force", "ship", "storm", "river",
+)
+EPOCH = datetime(2021, 6, 16, 20, 14, 9)
+# Роли и число персон в каждой, кроме актёров (у них скошенное распределение)
+CREW = (("writer", 0, 3), ("director", 0, 2))
+
+def content_ddl(path: Path = DUMP_PATH) -> Tuple[List[str], List[str]]:
+    """Операторы схемы content из дампа: (схема и таблицы, ключи и индексы).
+
+    Данные (блоки COPY), смена владельцев и объекты схемы public пропускаются.
+    """
+    tables, constraints = [], []
+    statement: List[str] = []
+    in_copy = False
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if in_copy:
+            in_copy = line != "\\."
+            continue
+        if not statement and line.startswith("COPY "):
+            in_copy = True
+            continue
+        if not statement and (not line.strip() or line.startswith("--")):
+            continue
+        statement.append(line)
+        if not line.rstrip().endswith(";"):
+            continue
+        text = "\n".join(statement)
+        statement = []
+        if "OWNER TO" in text:
+            continue
+        if text.startswith("CREATE SCHEMA") or text.startswith("CREATE TABLE content."):
+            tables.append(text)
+        elif "content." in text and text.startswith(("ALTER TABLE ONLY", "CREATE INDEX", "CREATE UNIQUE INDEX")):
+            constraints.append(text)
+    return tables, constraints
+
+def record_id(seed: int, kind: str, number: int) -> str:
+    """UUID записи по её номеру: тот же seed даёт тот же каталог, а id не нужно держать в памяти."""
+    digest = hashlib.blake2b(f"{seed}:{kind}:{number}".encode(), digest_size=16).hexdigest()
+    return f"{digest[:8]}-{digest[8:12]}-{digest[12:16]}-{digest[16:20]}-{digest[20:]}"
+
+def copy_value(value: Any) -> str:
+    """Значение в текстовом формате COPY."""
+    if value is None:
+        return "\\N"
+    value = str(value)
+    if "\\" in value or "\t" in value or "\n" in value:
+        value = value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+    return value
+
+class CopyStream:
+    """Файлоподобный источник для cursor.copy_expert: строки COPY генерируются по мере чтения."""
+
+    def __init__(self, rows: Iterator[Sequence[Any]]):
+        self._rows = rows
+        self._buffer = bytearray()
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = "".join("\t".join(map(copy_value, row)) + "\n" for row in islice(self._rows, 1000))
+            if not chunk:
+                break
+            self._buffer += chunk.encode("utf-8")
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+class Catalogue:
+    """Параметры каталога и генераторы строк его таблиц.
+
+    Состав фильма вычисляется из (seed, номер фильма) заново при каждом проходе,
+    поэтому film_work и связующие таблицы пишутся отдельными COPY без хранения связей.
+    """
+
+    def __init__(self, films: int, persons_per_film: float = 4.0, max_cast: int = 400, seed: int = 42):
+        self.films = films
+        self.persons = max(1, int(films * persons_per_film))
+        self.max_cast = max_cast
+        self.seed = seed
+
+    def _film_random(self, number: int) -> random.Random:
+        return random.Random(self.seed * 1_000_003 + number)
+
+    def _timestamp(self, rnd: random.Random) -> str:
+        return (EPOCH + timedelta(seconds=rnd.randrange(365 * 24 * 3600), microseconds=rnd.randrange(10 ** 6))).isoformat(sep=" ")
+
+    def _person_number(self, rnd: random.Random) -> int:
+        # Куб равномерной величины смещает выбор к первым номерам: они и есть «звёзды»
+        return int(self.persons * rnd.random() ** 3)
+
+    def film_links(self, number: int) -> Tuple[List[int], List[Tuple[int, str]]]:
+        """Номера жанров и пары (номер персоны, роль) фильма."""
+        rnd = self._film_random(number)
+        genres = rnd.sample(range(len(GENRES)), rnd.randint(1, 3))
+        credits = []
+        cast = min(int(rnd.paretovariate(1.5) * 1.5), self.max_cast)
+        for role, size in (("actor", cast),) + tuple((role, rnd.randint(low, high)) for role, low, high in CREW):
+            # Повторный выбор той же персоны в той же роли просто пропускается
+            credits.extend((person, role) for person in {self._person_number(rnd) for _ in range(size)})
+        return genres, credits
+
+    def genre_rows(self) -> Iterator[tuple]:
+        for number, name in enumerate(GENRES):
+            yield record_id(self.seed, "genre", number), name, None, EPOCH, EPOCH
+
+    def person_rows(self) -> Iterator[tuple]:
+        rnd = random.Random(self.seed)
+        for number in range(self.persons):
+            created = self._timestamp(rnd)
+            yield record_id(self.seed, "person", number), f"Person {number}", created, created
+
+    def film_rows(self) -> Iterator[tuple]:
+        rnd = random.Random(self.seed + 1)
+        for number in range(self.films):
+            description: Optional[str] = None
+            if rnd.random() < 0.8:
+                description = " ".join(rnd.choices(WORDS, k=rnd.randint(10, 60))).capitalize() + "."
+            rating = round(rnd.uniform(1, 10), 1) if rnd.random() < 0.9 else None
+            creation_date = date(1950, 1, 1) + timedelta(days=rnd.randrange(70 * 365)) if rnd.random() < 0.5 else None
+            film_type = "movie" if rnd.random() < 0.8 else "tv_show"
+            created = self._timestamp(rnd)
+            yield (
+                record_id(self.seed, "film", number), f"Film {number} {rnd.choice(WORDS)}", description,
+                creation_date, rating, film_type, created, created,
+            )
+
+    def genre_link_rows(self) -> Iterator[tuple]:
+        for number in range(self.films):
+            film_id = record_id(self.seed, "film", number)
+            for genre in self.film_links(number)[0]:
+                yield record_id(self.seed, f"gfw-{number}", genre), record_id(self.seed, "genre", genre), film_id, EPOCH
+
+    def person_link_rows(self) -> Iterator[tuple]:
+        for number in range(self.films):
+            film_id = record_id(self.seed, "film", number)
+            for person, role in self.film_links(number)[1]:
+                yield (
+                    record_id(self.seed, f"pfw-{number}-{role}", person), record_id(self.seed, "person", person),
+                    film_id, role, EPOCH,
+                )
+
+def generate_catalogue(dsn: str, catalogue: Catalogue):
+    """Пересоздаёт таблицы content.* и заполняет их каталогом одной транзакцией."""
+    tables, constraints = content_ddl()
+    copies = (
+        ("genre", "id, name, description, created, modified", catalogue.genre_rows()),
+        ("person", "id, full_name, created, modified", catalogue.person_rows()),
+        ("film_work", "id, title, description, creation_date, rating, type, created, modified", catalogue.film_rows()),
+        ("genre_film_work", "id, genre_id, film_work_id, created", catalogue.genre_link_rows()),
+        ("person_film_work", "id, person_id, film_work_id, role, created", catalogue.person_link_rows()),
+    )
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            # Триггеры уведомлений (миграции) удаляются вместе с таблицами: COPY не шлёт NOTIFY на каждую строку
+            cur.execute("DROP TABLE IF EXISTS " + ", ".join(f"content.{table}" for table in TABLES) + " CASCADE;")
+            for statement in tables:
+                cur.execute(statement)
+            for table, columns, rows in copies:
+                started = time.monotonic()
+                cur.copy_expert(f"COPY content.{table} ({columns}) FROM STDIN", CopyStream(rows), size=1 << 20)
+                logger.info(f"Generated content.{table}: {cur.rowcount} rows in {time.monotonic() - started:.1f}s.")
+            # Ключи и индексы строятся один раз по готовым данным, а не поддерживаются на каждой строке
+            started = time.monotonic()
+            for statement in constraints:
+                cur.execute(statement)
+            logger.info(f"Built keys and indexes in {time.monotonic() - started:.1f}s.")
+        conn.commit()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE " + ", ".join(f"content.{table}" for table in TABLES) + ";")
+    finally:
+        conn.close()
+    apply_migrations(dsn)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="отдельная база: таблицы content.* будут пересозданы")
+    parser.add_argument("--films", type=int, default=10000)
+    parser.add_argument("--persons-per-film", type=float, default=4.0)
+    parser.add_argument("--max-cast", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    catalogue = Catalogue(args.films, args.persons_per_film, args.max_cast, args.seed)
+    started = time.monotonic()
+    generate_catalogue(args.dsn, catalogue)
+    print(json.dumps({
+        "benchmark": "catalogue",
+        "films": catalogue.films,
+        "persons": catalogue.persons,
+        "seed": catalogue.seed,
+        "seconds": round(time.monotonic() - started, 1),
+    }))
+
+if __name__ == "__main__":
+    main()
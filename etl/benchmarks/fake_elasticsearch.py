@@ -0,0 +1,255 @@
+"""Поддельный Elasticsearch для бенчмарков: принимает _bulk и отвечает успехом, ничего не индексируя.
+
+Поддерживает то, что вызывает ElasticLoader: проверку продукта (GET /), создание, удаление и настройки
+индексов, алиасы, refresh, _count и _bulk (в том числе сжатый gzip, es_http_compress).
+Хранит только id документов по индексам - этого достаточно для _count; для 10M документов это около 1 ГБ.
+
+Сервер работает в отдельном процессе: в одном интерпретаторе с ETL он делил бы с ним GIL и память,
+и замер включал бы стоимость самой подделки.
+
+Отдельный запуск (например, чтобы направить на него etl.main):
+    python -m benchmarks.fake_elasticsearch --port 9200
+"""
+import argparse
+import fnmatch
+import gzip
+import multiprocessing
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.connection import wait
+from typing import Any, Dict, Iterator, List, Optional, Set
+from urllib.parse import unquote, urlsplit
+
+import orjson
+
+VERSION_INFO = {
+    "name": "fake",
+    "cluster_name": "fake-elasticsearch",
+    "version": {"number": "7.17.0", "build_flavor": "default", "lucene_version": "8.11.1"},
+    "tagline": "You Know, for Search",
+}
+ACKNOWLEDGED = {"acknowledged": True}
+
+class FakeCluster:
+    """Индексы (множества id документов) и алиасы; доступ из потоков сервера под одной блокировкой."""
+
+    def __init__(self):
+        self.indices: Dict[str, Set[str]] = {}
+        self.aliases: Dict[str, Set[str]] = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, name: str) -> List[str]:
+        """Индексы по имени, алиасу или шаблону; несколько имён - через запятую."""
+        result = []
+        for part in name.split(","):
+            if part in self.aliases:
+                result.extend(sorted(self.aliases[part]))
+            elif "*" in part:
+                result.extend(sorted(fnmatch.filter(self.indices, part)))
+            elif part in self.indices:
+                result.append(part)
+        return result
+
+    def write_index(self, name: str) -> str:
+        """Индекс для записи: алиас должен указывать на один индекс, несуществующий индекс создаётся."""
+        if name in self.aliases:
+            (name,) = self.aliases[name]
+        self.indices.setdefault(name, set())
+        return name
+
+    def bulk(self, body: bytes, default_index: Optional[str]) -> Dict[str, Any]:
+        lines = [line for line in body.split(b"\n") if line.strip()]
+        items = []
+        position = 0
+        with self.lock:
+            while position < len(lines):
+                ((action, meta),) = orjson.loads(lines[position]).items()
+                position += 1
+                index = self.write_index(meta.get("_index") or default_index)
+                doc_id = meta.get("_id")
+                documents = self.indices[index]
+                if action == "delete":
+                    found = doc_id in documents
+                    documents.discard(doc_id)
+                    status, result = (200, "deleted") if found else (404, "not_found")
+                else:
+                    # Строка с документом не разбирается: подделка не индексирует содержимое
+                    position += 1
+                    status, result = (200, "updated") if doc_id in documents else (201, "created")
+                    documents.add(doc_id)
+                items.append({action: {"_index": index, "_id": doc_id, "status": status, "result": result}})
+        return {"took": 0, "errors": False, "items": items}
+
+    def update_aliases(self, actions: List[Dict[str, Any]]):
+        with self.lock:
+            for action in actions:
+                ((kind, params),) = action.items()
+                if kind == "add":
+                    self.aliases.setdefault(params["alias"], set()).add(params["index"])
+                elif kind == "remove":
+                    self.aliases.get(params["alias"], set()).discard(params["index"])
+                    if not self.aliases.get(params["alias"], True):
+                        del self.aliases[params["alias"]]
+                elif kind == "remove_index":
+                    self.delete(params["index"])
+
+    def delete(self, name: str):
+        for index in self.resolve(name):
+            del self.indices[index]
+            for alias in list(self.aliases):
+                self.aliases[alias].discard(index)
+                if not self.aliases[alias]:
+                    del self.aliases[alias]
+
+class FakeElasticsearchHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1: клиент держит соединения открытыми, как с настоящим кластером
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def cluster(self) -> FakeCluster:
+        return self.server.cluster
+
+    def log_message(self, format, *args):
+        pass
+
+    def _path(self) -> List[str]:
+        return [unquote(part) for part in urlsplit(self.path).path.split("/") if part]
+
+    def _body(self) -> bytes:
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return body
+
+    def _reply(self, status: int, payload: Any = None):
+        body = b"" if payload is None else orjson.dumps(payload)
+        self.send_response(status)
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _error(self, status: int, error_type: str, reason: str):
+        self._reply(status, {"error": {"type": error_type, "reason": reason}, "status": status})
+
+    def _unsupported(self):
+        self._error(400, "unsupported_by_fake", f"{self.command} {self.path} is not supported by the fake cluster")
+
+    def _count(self, name: str):
+        with self.cluster.lock:
+            count = sum(len(self.cluster.indices[index]) for index in self.cluster.resolve(name))
+        self._reply(200, {"count": count, "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0}})
+
+    def do_HEAD(self):
+        path = self._path()
+        with self.cluster.lock:
+            if len(path) == 2 and path[0] == "_alias":
+                exists = path[1] in self.cluster.aliases
+            elif len(path) == 1:
+                exists = bool(self.cluster.resolve(path[0]))
+            else:
+                return self._unsupported()
+        self._reply(200 if exists else 404)
+
+    def do_GET(self):
+        path = self._path()
+        if not path:
+            return self._reply(200, VERSION_INFO)
+        if len(path) == 2 and path[0] == "_alias":
+            with self.cluster.lock:
+                indices = self.cluster.aliases.get(path[1])
+                if not indices:
+                    return self._error(404, "aliases_not_found_exception", f"alias [{path[1]}] missing")
+                return self._reply(200, {index: {"aliases": {path[1]: {}}} for index in indices})
+        if len(path) == 2 and path[1] == "_count":
+            return self._count(path[0])
+        if len(path) == 1:
+            with self.cluster.lock:
+                indices = self.cluster.resolve(path[0])
+                if not indices and "*" not in path[0]:
+                    return self._error(404, "index_not_found_exception", f"no such index [{path[0]}]")
+                return self._reply(200, {
+                    index: {
+                        "aliases": {alias: {} for alias, targets in self.cluster.aliases.items() if index in targets},
+                        "mappings": {}, "settings": {},
+                    }
+                    for index in indices
+                })
+        self._unsupported()
+
+    def do_PUT(self):
+        path = self._path()
+        self._body()
+        if len(path) == 1:
+            with self.cluster.lock:
+                if path[0] in self.cluster.indices or path[0] in self.cluster.aliases:
+                    return self._error(400, "resource_already_exists_exception", f"index [{path[0]}] already exists")
+                self.cluster.indices[path[0]] = set()
+            return self._reply(200, {"acknowledged": True, "shards_acknowledged": True, "index": path[0]})
+        if len(path) == 2 and path[1] == "_settings":
+            return self._reply(200, ACKNOWLEDGED)
+        self._unsupported()
+
+    def do_POST(self):
+        path = self._path()
+        body = self._body()
+        if path and path[-1] == "_bulk" and len(path) <= 2:
+            return self._reply(200, self.cluster.bulk(body, path[0] if len(path) == 2 else None))
+        if path == ["_aliases"]:
+            self.cluster.update_aliases(orjson.loads(body)["actions"])
+            return self._reply(200, ACKNOWLEDGED)
+        if len(path) == 2 and path[1] == "_refresh":
+            return self._reply(200, {"_shards": {"total": 1, "successful": 1, "failed": 0}})
+        if len(path) == 2 and path[1] == "_count":
+            return self._count(path[0])
+        self._unsupported()
+
+    def do_DELETE(self):
+        path = self._path()
+        if len(path) == 1:
+            with self.cluster.lock:
+                if not self.cluster.resolve(path[0]):
+                    return self._error(404, "index_not_found_exception", f"no such index [{path[0]}]")
+                self.cluster.delete(path[0])
+            return self._reply(200, ACKNOWLEDGED)
+        self._unsupported()
+
+def serve(port: int = 0, ready=None):
+    """Обслуживает запросы до завершения процесса; фактический порт отправляет в ready (Connection)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeElasticsearchHandler)
+    server.daemon_threads = True
+    server.cluster = FakeCluster()
+    if ready is not None:
+        ready.send(server.server_address[1])
+        ready.close()
+    server.serve_forever()
+
+@contextmanager
+def running_fake_elasticsearch() -> Iterator[str]:
+    """Запускает подделку в отдельном процессе на свободном порту и отдаёт её URL."""
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=serve, args=(0, sender), name="fake-elasticsearch", daemon=True)
+    process.start()
+    try:
+        # Ждём порт либо завершения процесса, если сервер не смог запуститься
+        wait([receiver, process.sentinel], timeout=30)
+        if not receiver.poll():
+            raise RuntimeError(f"Fake Elasticsearch did not start (exit code {process.exitcode}).")
+        yield f"http://127.0.0.1:{receiver.recv()}"
+    finally:
+        process.terminate()
+        process.join()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9200)
+    args = parser.parse_args()
+    print(f"Fake Elasticsearch listening on http://127.0.0.1:{args.port}")
+    serve(args.port)
+
+if __name__ == "__main__":
+    main()
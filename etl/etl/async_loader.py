@@ -0,0 +1,59 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Union
+from elasticsearch import AsyncElasticsearch
+from .loader import Outcome, bulk_chunk_size, bulk_exchange, refresh_policy, serialize_documents
+from .dead_letters import DeadLetterQueue
+from .utils import backoff
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+class AsyncElasticLoader:
+    """Асинхронный аналог ElasticLoader.load для инкрементальной загрузки.
+
+    Создание индекса, алиасы и полная загрузка остаются в синхронном ElasticLoader.
+    """
+
+    def __init__(self):
+        self.client = AsyncElasticsearch(
+            hosts=[str(settings.elastic_host)], max_retries=3, retry_on_timeout=True,
+            http_compress=settings.es_http_compress,
+        )
+        self.index_name = settings.elastic_index
+        self.dead_letters = DeadLetterQueue()
+        self.chunk_size = bulk_chunk_size()
+
+    @backoff
+    async def _send_ndjson(self, body: bytes, refresh: Union[bool, str] = False) -> List[Dict[str, Any]]:
+        response = await self.client.bulk(
+            body=body, refresh=refresh, request_timeout=60, filter_path="items.*.status,items.*.error",
+        )
+        return [next(iter(item.values())) for item in response.get("items", [])]
+
+    async def load(self, documents: List[Dict[str, Any]], index: Optional[str] = None) -> List[Outcome]:
+        """Инкрементальная загрузка пачки с разбором ответа по документам, как ElasticLoader.load."""
+        if not documents:
+            logger.info("No documents to load.")
+            return []
+
+        index = index or self.index_name
+        refresh = refresh_policy(settings.es_incremental_refresh)
+        exchange = bulk_exchange(serialize_documents(documents), index, self.chunk_size, self.dead_letters)
+        try:
+            delay, body = next(exchange)
+            while True:
+                if delay:
+                    await asyncio.sleep(delay)
+                started = time.monotonic()
+                items = await self._send_ndjson(body, refresh)
+                delay, body = exchange.send((items, time.monotonic() - started))
+        except StopIteration as done:
+            outcome = done.value
+        logger.info(f"Successfully loaded {outcome.count(True)} documents into {index}. Failed: {len(outcome) - outcome.count(True)}")
+        return outcome
+
+    async def close(self):
+        await self.client.close()
+        self.dead_letters.close()
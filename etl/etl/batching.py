@@ -0,0 +1,76 @@
+import logging
+import threading
+from typing import List, Optional, Sequence
+from .config import settings
+from .metrics import BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+class AdaptiveBatchSize:
+    """Размер пачки, подстраиваемый под наблюдаемую стоимость строки.
+
+    После каждой пачки оценивается, сколько строк укладывается в target_seconds и в max_bytes
+    при той же стоимости строки, и размер сдвигается на полпути к этой оценке (не больше чем вдвое
+    за шаг). Отказы из-за перегрузки (rejected) сразу уменьшают размер вдвое.
+    Время учитывается только у полных пачек: в короткой (последняя страница прохода, редкие изменения
+    в цикле) основную долю занимает постоянная задержка запроса, и оценка по ней занижала бы размер.
+    Результат всегда в пределах [minimum, maximum]. Наблюдения могут приходить из нескольких потоков.
+    """
+
+    def __init__(self, name: str, initial: int, minimum: int, maximum: int,
+                 target_seconds: float, max_bytes: Optional[int] = None):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        self.enabled = settings.adaptive_batching
+        self.value = self._clamp(initial)
+        self._lock = threading.Lock()
+        self._gauge = BATCH_SIZE.labels(name)
+        self._gauge.set(self.value)
+
+    def _clamp(self, value: float) -> int:
+        return max(self.minimum, min(self.maximum, int(value)))
+
+    def observe(self, rows: int, seconds: float, nbytes: int = 0, rejected: int = 0):
+        """Учитывает пачку из rows строк, обработанную за seconds секунд, размером nbytes байт."""
+        if not self.enabled or rows <= 0:
+            return
+        with self._lock:
+            old = self.value
+            if not rejected and rows < old:
+                return
+            if rejected:
+                new = old / 2
+            else:
+                fitting = rows * self.target_seconds / max(seconds, 1e-3)
+                if self.max_bytes and nbytes:
+                    fitting = min(fitting, rows * self.max_bytes / nbytes)
+                new = min((old + fitting) / 2, old * 2)
+            self.value = self._clamp(new)
+            self._gauge.set(self.value)
+            # В лог попадают только заметные изменения, чтобы не засорять его каждой пачкой
+            if abs(self.value - old) >= max(1, old // 10):
+                logger.info(
+                    f"Batch size {self.name}: {old} -> {self.value} "
+                    f"({rows} rows in {seconds:.3f}s, {nbytes} bytes, {rejected} rejected)"
+                )
+
+def split_by_size(sizes: Sequence[int], max_items: int, max_bytes: int) -> List[range]:
+    """Делит элементы с размерами sizes на подряд идущие куски не больше max_items штук и max_bytes байт.
+
+    Элемент больше max_bytes уходит отдельным куском.
+    """
+    chunks = []
+    start = 0
+    total = 0
+    for position, size in enumerate(sizes):
+        if position > start and (position - start >= max_items or total + size > max_bytes):
+            chunks.append(range(start, position))
+            start = position
+            total = 0
+        total += size
+    if start < len(sizes):
+        chunks.append(range(start, len(sizes)))
+    return chunks
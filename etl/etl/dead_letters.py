@@ -0,0 +1,92 @@
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Any, Iterable, List, Optional, Tuple
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Ограничение SQLite на число параметров в одном запросе
+_SQLITE_CHUNK = 500
+
+# (id документа, индекс, HTTP-статус элемента, ошибка Elasticsearch, документ в виде текста JSON)
+DeadLetter = Tuple[str, str, int, Any, str]
+
+class DeadLetterQueue:
+    """Документы, которые Elasticsearch отверг окончательно (ошибки маппинга, разбора и т.п.).
+
+    Хранится в SQLite (режим WAL), по одной записи на документ - повторный отказ заменяет прежний.
+    В файл пишут и процессы партиций полной загрузки, поэтому ждём блокировку файла, а не падаем.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path if path is not None else settings.dead_letter_path
+        # Загрузчик обращается к очереди из потоков пула; файл создаётся только при первом обращении
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS dead_letter ("
+                "id TEXT PRIMARY KEY, index_name TEXT NOT NULL, status INTEGER NOT NULL, "
+                "error TEXT NOT NULL, document TEXT NOT NULL, failed_at TEXT NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def add(self, letters: Iterable[DeadLetter]):
+        failed_at = datetime.now(timezone.utc).isoformat()
+        rows = [
+            (doc_id, index, status, json.dumps(error, ensure_ascii=False), document, failed_at)
+            for doc_id, index, status, error, document in letters
+        ]
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO dead_letter (id, index_name, status, error, document, failed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.commit()
+        logger.error(f"Moved {len(rows)} rejected documents to dead-letter queue {self.path}.")
+
+    def ids(self, alias: Optional[str] = None) -> List[str]:
+        """id документов в очереди; с alias - только отвергнутых этим алиасом или его версиями (<alias>_<метка времени>)."""
+        with self._lock:
+            if alias is None:
+                rows = self._connection().execute("SELECT id FROM dead_letter ORDER BY id")
+            else:
+                rows = self._connection().execute(
+                    "SELECT id FROM dead_letter WHERE index_name = ? OR index_name GLOB ? ORDER BY id",
+                    (alias, f"{alias}_[0-9]*"),
+                )
+            return [row[0] for row in rows]
+
+    def remove(self, ids: List[str]):
+        with self._lock:
+            conn = self._connection()
+            for start in range(0, len(ids), _SQLITE_CHUNK):
+                chunk = ids[start:start + _SQLITE_CHUNK]
+                conn.execute(f"DELETE FROM dead_letter WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+            conn.commit()
+
+    def count(self, index: Optional[str] = None) -> int:
+        with self._lock:
+            if index is None:
+                return self._connection().execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+            return self._connection().execute(
+                "SELECT COUNT(*) FROM dead_letter WHERE index_name = ?", (index,)
+            ).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
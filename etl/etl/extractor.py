@@ -1,30 +1,370 @@
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+import orjson
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import List, Dict, Any, Optional
+from psycopg2.extras import RealDictCursor, register_default_json
+from psycopg2.pool import ThreadedConnectionPool
+from typing import List, Dict, Any, Optional, Iterator, Tuple, Callable, Set
 from .utils import backoff # Импортируем универсальный декоратор
 from .config import settings
-from .queries import EXTRACT_FILMWORK_QUERY
+from .batching import AdaptiveBatchSize
+from .metrics import DIMENSION_CACHE_LOOKUPS, observe_stage, timed_stage
+from .queries import EXTRACT_FILMWORK_QUERY, STREAM_FILMWORK_PARTITION_QUERY, STREAM_DOCUMENT_PARTITION_QUERY, EXTRACT_FILMWORK_BY_IDS_QUERY, COUNT_FILMWORK_QUERY
+from .queries import (
+    EXTRACT_FILMWORK_LINKS_QUERY, EXTRACT_FILMWORK_LINKS_BY_IDS_QUERY, PERSON_NAMES_QUERY, GENRE_NAMES_QUERY,
+    CHANGED_PERSONS_QUERY, CHANGED_GENRES_QUERY, PERSON_HEAD_QUERY, GENRE_HEAD_QUERY,
+)
+
+logger = logging.getLogger(__name__)
+
+# Участники фильмов приходят из Postgres как json: декодируем их orjson, а не стандартным json
+register_default_json(globally=True, loads=orjson.loads)
+
+# Курсор keyset-пагинации: (modified в ISO-формате, id фильма)
+Cursor = Tuple[str, str]
+
+INITIAL_CURSOR: Cursor = ("1900-01-01T00:00:00.000+00:00", "00000000-0000-0000-0000-000000000000")
+
+def postgres_page_size() -> AdaptiveBatchSize:
+    return AdaptiveBatchSize(
+        "postgres_page", settings.batch_size, settings.batch_size_min, settings.batch_size_max,
+        settings.page_target_seconds,
+    )
+
+def row_cursor(row: Dict[str, Any]) -> Cursor:
+    """Курсор, указывающий на переданную строку film_work."""
+    return row['modified'].isoformat(), str(row['id'])
+
+# Колонка FILMWORK_SELECT с участниками -> колонка FILMWORK_LINKS_SELECT с их id
+ROLE_ID_COLUMNS = {"actors": "actor_ids", "writers": "writer_ids", "directors": "director_ids"}
+
+class DimensionCache:
+    """Имена персон и жанров в памяти процесса для режима dimension_cache.
+
+    Страница фильмов тогда приходит из Postgres только с id связей (FILMWORK_LINKS_SELECT),
+    а строки в формате FILMWORK_SELECT собираются здесь по тем же правилам, что и в SQL.
+    Персоны хранятся в LRU на dimension_cache_size записей, жанры (их единицы) - целиком.
+
+    Перед каждой сборкой кеш сверяется с изменениями person и genre по modified, тем же keyset-курсором,
+    что у продюсеров: изменённые персоны вытесняются, жанры перечитываются. Запись старше
+    dimension_cache_ttl секунд читается заново - так подхватываются удаления и правки без нового modified.
+    Кеш не потокобезопасен: он принадлежит одному PostgresExtractor.
+    """
+
+    def __init__(self, extractor: "PostgresExtractor"):
+        self.extractor = extractor
+        self.max_size = settings.dimension_cache_size
+        self.ttl = settings.dimension_cache_ttl
+        # id персоны -> (имя или None, если в документы персона не попадает; время загрузки)
+        self._persons: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+        # id жанра -> (место в порядке названий, название); только жанры, которые попадают в документы
+        self._genres: Dict[str, Tuple[int, str]] = {}
+        self._genres_loaded_at: Optional[float] = None
+        self._person_cursor: Optional[Cursor] = None
+        self._genre_cursor: Optional[Cursor] = None
+
+    def _changed_ids(self, query: str, cursor: Cursor) -> Tuple[Set[str], Cursor]:
+        changed: Set[str] = set()
+        while True:
+            rows = self.extractor.extract_changes(query, cursor)
+            if not rows:
+                break
+            changed.update(str(row['id']) for row in rows)
+            cursor = row_cursor(rows[-1])
+            if len(rows) < self.extractor.batch_size:
+                break
+        return changed, cursor
+
+    def refresh(self):
+        """Забывает персоны и жанры, изменённые с прошлой сверки."""
+        if self._person_cursor is None:
+            # Всё, что загружается в кеш после этого, не старше текущей головы таблиц
+            self._person_cursor = self.extractor.extract_head(PERSON_HEAD_QUERY) or INITIAL_CURSOR
+            self._genre_cursor = self.extractor.extract_head(GENRE_HEAD_QUERY) or INITIAL_CURSOR
+            return
+        changed, self._person_cursor = self._changed_ids(CHANGED_PERSONS_QUERY, self._person_cursor)
+        for person_id in changed:
+            self._persons.pop(person_id, None)
+        changed, self._genre_cursor = self._changed_ids(CHANGED_GENRES_QUERY, self._genre_cursor)
+        if changed:
+            self._genres_loaded_at = None
+
+    def genres(self) -> Dict[str, Tuple[int, str]]:
+        now = time.monotonic()
+        if self._genres_loaded_at is not None and now - self._genres_loaded_at <= self.ttl:
+            DIMENSION_CACHE_LOOKUPS.labels("genre", "hit").inc()
+            return self._genres
+        DIMENSION_CACHE_LOOKUPS.labels("genre", "miss").inc()
+        self._genres = {
+            row['id']: (row['position'], row['name'])
+            for row in self.extractor.extract_all(GENRE_NAMES_QUERY) if row['valid']
+        }
+        self._genres_loaded_at = now
+        return self._genres
+
+    def person_names(self, ids: Set[str]) -> Dict[str, Optional[str]]:
+        """Имена персон по id; None - персона без имени или удалённая, в документы она не попадает."""
+        now = time.monotonic()
+        names: Dict[str, Optional[str]] = {}
+        missing = []
+        for person_id in ids:
+            entry = self._persons.get(person_id)
+            if entry is None or now - entry[1] > self.ttl:
+                missing.append(person_id)
+            else:
+                self._persons.move_to_end(person_id)
+                names[person_id] = entry[0]
+        DIMENSION_CACHE_LOOKUPS.labels("person", "hit").inc(len(names))
+        if not missing:
+            return names
+        DIMENSION_CACHE_LOOKUPS.labels("person", "miss").inc(len(missing))
+        loaded = {row['id']: row['name'] for row in self.extractor.extract_by_ids(missing, PERSON_NAMES_QUERY)}
+        for person_id in missing:
+            names[person_id] = loaded.get(person_id)
+            self._persons[person_id] = (names[person_id], now)
+            self._persons.move_to_end(person_id)
+        while len(self._persons) > self.max_size:
+            self._persons.popitem(last=False)
+        return names
+
+    def assemble(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Строки FILMWORK_LINKS_SELECT -> строки в формате FILMWORK_SELECT для transform_movies.
+
+        Жанры с одинаковым названием схлопываются и сортируются по месту из GENRE_NAMES_QUERY,
+        участники уже упорядочены запросом; те, кого FILMWORK_SELECT отбросил бы, пропускаются.
+        """
+        if not rows:
+            return []
+        self.refresh()
+        genres = self.genres()
+        names = self.person_names({
+            person_id for row in rows for column in ROLE_ID_COLUMNS.values() for person_id in row[column]
+        })
+        assembled = []
+        for row in rows:
+            film = {
+                "id": row["id"],
+                "title": row["title"],
+                "description": row["description"],
+                "imdb_rating": row["imdb_rating"],
+                "modified": row["modified"],
+                "genres": [name for _, name in sorted({genres[g] for g in row["genre_ids"] if g in genres})],
+            }
+            for key, column in ROLE_ID_COLUMNS.items():
+                film[key] = [
+                    {"id": person_id, "name": names[person_id]}
+                    for person_id in row[column] if names[person_id] is not None
+                ]
+            assembled.append(film)
+        return assembled
 
 class PostgresExtractor:
     def __init__(self):
         self.dsn = str(settings.postgres_dsn)
         self.batch_size = settings.batch_size
+        # Размер страницы film_work (LIMIT и пачки потокового чтения) подстраивается под время запроса
+        self.page_size = postgres_page_size()
+        # Пул создаётся лениво, чтобы недоступная при старте БД обрабатывалась через backoff
+        self._pool: Optional[ThreadedConnectionPool] = None
+        # Страницы и переиндексация по id без соединений с genre и person (потоки полной загрузки - как раньше)
+        self.dimensions = DimensionCache(self) if settings.dimension_cache else None
+
+    def _get_pool(self) -> ThreadedConnectionPool:
+        if self._pool is None:
+            self._pool = ThreadedConnectionPool(settings.pg_pool_min_size, settings.pg_pool_max_size, self.dsn)
+        return self._pool
+
+    @contextmanager
+    def _connection(self):
+        """Выдаёт соединение из пула и возвращает его обратно; разорванные соединения закрываются."""
+        pool = self._get_pool()
+        conn = pool.getconn()
+        try:
+            yield conn
+        finally:
+            broken = conn.closed != 0
+            if not broken:
+                try:
+                    # Мы только читаем, поэтому просто завершаем транзакцию (и серверный курсор)
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            pool.putconn(conn, close=broken)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.closeall()
+            self._pool = None
 
     @backoff # Применяем универсальный декоратор
-    def extract_batch(self, last_modified: str) -> List[Dict[str, Any]]:
-        query = EXTRACT_FILMWORK_QUERY
-        with psycopg2.connect(self.dsn) as conn:
+    def extract_batch(self, cursor: Cursor) -> List[Dict[str, Any]]:
+        query = EXTRACT_FILMWORK_QUERY if self.dimensions is None else EXTRACT_FILMWORK_LINKS_QUERY
+        last_modified, last_id = cursor
+        with self._connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute(query, (last_modified, self.batch_size))
+                started = time.monotonic()
+                cur.execute(query, (last_modified, last_id, self.page_size.value))
+                rows = cur.fetchall()
+                elapsed = time.monotonic() - started
+                self.page_size.observe(len(rows), elapsed)
+                observe_stage("extract", elapsed, len(rows))
+        # Соединение уже возвращено в пул: кешу могут понадобиться свои запросы
+        return rows if self.dimensions is None else self._assemble(rows)
+
+    def _assemble(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        with timed_stage("assemble", len(rows)):
+            return self.dimensions.assemble(rows)
+
+    def extract_batches(self, start_cursor: Cursor = INITIAL_CURSOR) -> Iterator[List[Dict[str, Any]]]:
+        """Отдаёт пачки строк по мере чтения из Postgres, не накапливая всю таблицу в памяти."""
+        current_cursor = start_cursor
+        while True:
+            rows = self.extract_batch(current_cursor)
+            if not rows:
+                break
+            yield rows
+            # Строки упорядочены по (modified, id), последняя строка и есть новый курсор
+            current_cursor = row_cursor(rows[-1])
+
+    @backoff
+    def count_films(self) -> int:
+        with self._connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(COUNT_FILMWORK_QUERY)
+                return cur.fetchone()[0]
+
+    @backoff
+    def extract_by_ids(self, ids: List[str], query: str = EXTRACT_FILMWORK_BY_IDS_QUERY) -> List[Dict[str, Any]]:
+        """Строки с заданными id; по умолчанию полные строки фильмов в формате EXTRACT_FILMWORK_QUERY."""
+        links = self.dimensions is not None and query == EXTRACT_FILMWORK_BY_IDS_QUERY
+        with self._connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(EXTRACT_FILMWORK_LINKS_BY_IDS_QUERY if links else query, (ids,))
+                rows = cur.fetchall()
+        return self._assemble(rows) if links else rows
+
+    @backoff
+    def extract_all(self, query: str) -> List[Dict[str, Any]]:
+        """Все строки запроса без параметров (небольшие справочники, например GENRE_NAMES_QUERY)."""
+        with self._connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(query)
+                return cur.fetchall()
+
+    @backoff
+    def _extract_id_page(self, query: str, after_id: str) -> List[Dict[str, Any]]:
+        with self._connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(query, (after_id, settings.fanout_batch_size))
                 return cur.fetchall()
 
-    def extract_all(self, start_modified: str = "1900-01-01T00:00:00.000+00:00") -> List[Dict[str, Any]]:
-        all_data = []
-        current_last_modified = start_modified
+    def extract_id_pages(self, query: str) -> Iterator[List[Dict[str, Any]]]:
+        """Вся выборка страницами в порядке id (запрос с after_id и LIMIT, например PERSONS_PAGE_QUERY)."""
+        after_id = INITIAL_CURSOR[1]
         while True:
-            rows = self.extract_batch(current_last_modified)
+            rows = self._extract_id_page(query, after_id)
             if not rows:
                 break
-            all_data.extend(rows)
-            current_last_modified = max(row['modified'] for row in rows).isoformat()
-        return all_data
+            yield rows
+            after_id = str(rows[-1]['id'])
+
+    @backoff
+    def extract_changes(self, query: str, cursor: Cursor) -> List[Dict[str, Any]]:
+        """Страница изменений зависимой таблицы после курсора (запрос из CHANGES_QUERY_TEMPLATE)."""
+        last_modified, last_id = cursor
+        with self._connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(query, (last_modified, last_id, self.batch_size))
+                return cur.fetchall()
+
+    @backoff
+    def extract_head(self, query: str) -> Optional[Cursor]:
+        """Курсор последней записи таблицы (запрос из HEAD_QUERY_TEMPLATE) или None для пустой таблицы."""
+        with self._connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(query)
+                row = cur.fetchone()
+        return row_cursor(row) if row else None
+
+    @backoff
+    def _extract_film_ids_page(self, query: str, ids: List[str], after_id: str) -> List[str]:
+        with self._connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, (ids, after_id, settings.fanout_batch_size))
+                return [str(row[0]) for row in cur.fetchall()]
+
+    def extract_film_ids(self, query: str, ids: List[str]) -> Iterator[List[str]]:
+        """Пачками отдаёт id фильмов, связанных с ids (запрос из FILM_IDS_QUERY_TEMPLATE)."""
+        after_id = INITIAL_CURSOR[1]
+        while True:
+            film_ids = self._extract_film_ids_page(query, ids, after_id)
+            if not film_ids:
+                break
+            yield film_ids
+            after_id = film_ids[-1]
+
+    def _stream_from(self, query: str, params: tuple, cursor_factory=RealDictCursor) -> Iterator[List[Any]]:
+        with self._connection() as conn:
+            # Именованный курсор живёт на сервере: запрос планируется и агрегируется один раз,
+            # а строки подтягиваются порциями по itersize
+            with conn.cursor(name="filmwork_stream", cursor_factory=cursor_factory) as cur:
+                cur.itersize = self.page_size.value
+                cur.execute(query, params)
+                batch = []
+                # Время набора пачки без времени её обработки потребителем
+                started = time.monotonic()
+                for row in cur:
+                    batch.append(row)
+                    if len(batch) >= self.page_size.value:
+                        elapsed = time.monotonic() - started
+                        self.page_size.observe(len(batch), elapsed)
+                        observe_stage("extract", elapsed, len(batch))
+                        cur.itersize = self.page_size.value
+                        yield batch
+                        batch = []
+                        started = time.monotonic()
+                if batch:
+                    observe_stage("extract", time.monotonic() - started, len(batch))
+                    yield batch
+
+    def _resumable_stream(self, query: str, start: Any, make_params: Callable[[Any], tuple],
+                          next_position: Callable[[Any], Any], cursor_factory=RealDictCursor) -> Iterator[List[Any]]:
+        """Потоковое чтение с продолжением после обрыва соединения с позиции последней отданной пачки."""
+        max_retries = 5
+        position = start
+        attempt = 0
+        while True:
+            try:
+                for rows in self._stream_from(query, make_params(position), cursor_factory):
+                    yield rows
+                    position = next_position(rows[-1])
+                    attempt = 0
+                return
+            except psycopg2.OperationalError as e:
+                attempt += 1
+                if attempt >= max_retries:
+                    logger.error(f"Max retries reached for stream: {e}")
+                    raise
+                delay = 2 ** (attempt - 1)
+                logger.warning(f"Stream interrupted: {e}. Resuming after {position} in {delay}s...")
+                time.sleep(delay)
+
+    def stream_partition(self, after_id: str, upper_id: str) -> Iterator[List[Dict[str, Any]]]:
+        """Потоковое чтение фильмов с id в диапазоне (after_id, upper_id] в порядке id."""
+        return self._resumable_stream(
+            STREAM_FILMWORK_PARTITION_QUERY, after_id,
+            lambda last_id: (last_id, upper_id),
+            lambda row: str(row['id']),
+        )
+
+    def stream_partition_documents(self, after_id: str, upper_id: str) -> Iterator[List[Tuple[str, str]]]:
+        """Как stream_partition, но отдаёт пары (id, документ в виде текста JSON), собранные в Postgres."""
+        return self._resumable_stream(
+            STREAM_DOCUMENT_PARTITION_QUERY, after_id,
+            lambda last_id: (last_id, upper_id),
+            lambda row: str(row[0]),
+            # Обычный курсор: кортежи дешевле словарей, а разбирать документ не нужно
+            cursor_factory=None,
+        )
@@ -0,0 +1,82 @@
+import hashlib
+import logging
+import sqlite3
+import uuid
+from typing import Any, Dict, Iterable, List
+import orjson
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Ограничение SQLite на число параметров в одном запросе
+_SQLITE_CHUNK = 500
+
+def document_hash(doc: Dict[str, Any]) -> bytes:
+    """Хеш документа, не зависящий от порядка ключей и записи JSON.
+
+    Postgres пишет рейтинг 8.0 как 8, а transform_movies - как 8.0: целые числа верхнего уровня
+    приводятся к float, чтобы документ из быстрой загрузки и из transform_movies давал один хеш.
+    Этой же функцией документы сравнивает режим verify.
+    """
+    canonical = {key: float(value) if type(value) is int else value for key, value in doc.items()}
+    return hashlib.blake2b(orjson.dumps(canonical, option=orjson.OPT_SORT_KEYS), digest_size=16).digest()
+
+class DocumentHashStore:
+    """Хеши последних проиндексированных документов, по UUID фильма (SQLite, режим WAL)."""
+
+    def __init__(self, path: str = None):
+        self.path = path if path is not None else settings.hash_store_path
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS doc_hash (id BLOB PRIMARY KEY, hash BLOB NOT NULL) WITHOUT ROWID"
+        )
+        self.conn.commit()
+
+    def filter_changed(self, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Оставляет только документы, которые отличаются от последней проиндексированной версии."""
+        known = {}
+        for start in range(0, len(documents), _SQLITE_CHUNK):
+            keys = [uuid.UUID(doc["id"]).bytes for doc in documents[start:start + _SQLITE_CHUNK]]
+            placeholders = ",".join("?" * len(keys))
+            known.update(self.conn.execute(f"SELECT id, hash FROM doc_hash WHERE id IN ({placeholders})", keys))
+        return [doc for doc in documents if known.get(uuid.UUID(doc["id"]).bytes) != document_hash(doc)]
+
+    def remember(self, documents: Iterable[Dict[str, Any]]):
+        """Запоминает хеши документов, которые Elasticsearch принял."""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO doc_hash (id, hash) VALUES (?, ?)",
+            ((uuid.UUID(doc["id"]).bytes, document_hash(doc)) for doc in documents),
+        )
+        self.conn.commit()
+
+    def forget(self, ids: Iterable[str]):
+        """Забывает хеши документов, удалённых из индекса."""
+        self.conn.executemany("DELETE FROM doc_hash WHERE id = ?", ((uuid.UUID(doc_id).bytes,) for doc_id in ids))
+        self.conn.commit()
+
+    def clear(self):
+        self.conn.execute("DELETE FROM doc_hash")
+        self.conn.commit()
+        logger.info(f"Hash store {self.path} cleared.")
+
+    def rebuild(self, documents: Iterable[Dict[str, Any]], batch_size: int = 1000) -> int:
+        """Заполняет хранилище заново из документов индекса (например, ElasticLoader.scan_documents)."""
+        self.clear()
+        total = 0
+        batch = []
+        for doc in documents:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                self.remember(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            self.remember(batch)
+            total += len(batch)
+        logger.info(f"Hash store {self.path} rebuilt from {total} indexed documents.")
+        return total
+
+    def close(self):
+        self.conn.close()
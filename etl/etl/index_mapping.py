@@ -117,4 +117,63 @@ INDEX_MAPPING_BODY = {
             }
         }
     }
-}
\ No newline at end of file
+}
+
+# Производные индексы используют тот же анализатор ru_en, что и movies
+GENRES_INDEX_MAPPING_BODY = {
+    "settings": INDEX_MAPPING_BODY["settings"],
+    "mappings": {
+        "dynamic": "strict",
+        "properties": {
+            "id": {
+                "type": "keyword"
+            },
+            "name": {
+                "type": "text",
+                "analyzer": "ru_en",
+                "fields": {
+                    "raw": {
+                        "type": "keyword"
+                    }
+                }
+            },
+            "description": {
+                "type": "text",
+                "analyzer": "ru_en"
+            }
+        }
+    }
+}
+
+PERSONS_INDEX_MAPPING_BODY = {
+    "settings": INDEX_MAPPING_BODY["settings"],
+    "mappings": {
+        "dynamic": "strict",
+        "properties": {
+            "id": {
+                "type": "keyword"
+            },
+            "full_name": {
+                "type": "text",
+                "analyzer": "ru_en",
+                "fields": {
+                    "raw": {
+                        "type": "keyword"
+                    }
+                }
+            },
+            "films": {
+                "type": "nested",
+                "dynamic": "strict",
+                "properties": {
+                    "id": {
+                        "type": "keyword"
+                    },
+                    "roles": {
+                        "type": "keyword"
+                    }
+                }
+            }
+        }
+    }
+}
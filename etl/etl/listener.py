@@ -0,0 +1,127 @@
+import logging
+import select
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+import psycopg2
+from .extractor import PostgresExtractor
+from .producers import DEPENDENCY_PRODUCERS
+from .utils import backoff
+from .config import settings
+from .metrics import QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+# Канал, в который пишут триггеры content.etl_notify_change (миграции migrations/listen при listen_triggers=true)
+CHANGES_CHANNEL = "etl_changes"
+
+PRODUCERS_BY_TABLE = {producer.name: producer for producer in DEPENDENCY_PRODUCERS}
+
+Change = Tuple[str, str]
+
+class ChangeListener:
+    """Отдельное соединение с LISTEN на канале изменений.
+
+    Уведомления, пришедшие, пока соединения не было, теряются - после reconnect нужна сверка опросом.
+    """
+
+    def __init__(self, dsn: str = None, channel: str = CHANGES_CHANNEL):
+        self.dsn = dsn if dsn is not None else str(settings.postgres_dsn)
+        self.channel = channel
+        self.conn = None
+
+    @backoff
+    def connect(self):
+        self.close()
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {self.channel};")
+        self.conn = conn
+        logger.info(f"Listening for changes on channel {self.channel}.")
+
+    def poll(self, timeout: float) -> List[Change]:
+        """Ждёт уведомлений не дольше timeout секунд и возвращает пары (таблица, id)."""
+        if select.select([self.conn], [], [], max(timeout, 0)) == ([], [], []):
+            return []
+        self.conn.poll()
+        changes = []
+        while self.conn.notifies:
+            payload = self.conn.notifies.pop(0).payload
+            table, _, record_id = payload.partition(":")
+            if record_id:
+                changes.append((table, record_id))
+            else:
+                logger.warning(f"Ignoring malformed change notification: {payload!r}")
+        return changes
+
+    def close(self):
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+        self.conn = None
+
+class ChangeBatcher:
+    """Копит изменения и отдаёт их одной пачкой.
+
+    Пачка готова, когда поток уведомлений затих на debounce секунд, когда первое изменение ждёт
+    дольше max_delay или когда накопилось max_pending id.
+    """
+
+    def __init__(self, debounce: float, max_delay: float, max_pending: int):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.pending: Dict[str, Set[str]] = defaultdict(set)
+        self.size = 0
+        self.first_at: Optional[float] = None
+        self.last_at: Optional[float] = None
+
+    def add(self, changes: List[Change], now: float):
+        if not changes:
+            return
+        for table, record_id in changes:
+            ids = self.pending[table]
+            if record_id not in ids:
+                ids.add(record_id)
+                self.size += 1
+        if self.first_at is None:
+            self.first_at = now
+        self.last_at = now
+        QUEUE_DEPTH.labels("listen_pending").set(self.size)
+
+    def timeout(self, now: float) -> Optional[float]:
+        """Сколько ещё ждать до готовности пачки; None, если ждать нечего."""
+        if self.first_at is None:
+            return None
+        return max(0.0, min(self.last_at + self.debounce, self.first_at + self.max_delay) - now)
+
+    def due(self, now: float) -> bool:
+        return self.first_at is not None and (self.size >= self.max_pending or self.timeout(now) == 0)
+
+    def drain(self) -> Dict[str, Set[str]]:
+        pending = dict(self.pending)
+        self.pending = defaultdict(set)
+        self.size = 0
+        self.first_at = self.last_at = None
+        QUEUE_DEPTH.labels("listen_pending").set(0)
+        return pending
+
+def resolve_film_ids(changes: Dict[str, Set[str]], extractor: PostgresExtractor) -> Set[str]:
+    """Переводит изменённые записи в id фильмов, документы которых нужно перестроить.
+
+    film_work и связующие таблицы уже присылают id фильма; для персон и жанров
+    фильмы ищутся тем же запросом, что у соответствующего продюсера.
+    Уведомления '<таблица>.<колонка>' нужны только производным индексам (IndexTarget.notified_ids).
+    """
+    film_ids: Set[str] = set()
+    for table, ids in changes.items():
+        if "." in table:
+            continue
+        producer = PRODUCERS_BY_TABLE.get(table)
+        if producer is not None and producer.film_ids_query is not None:
+            for batch in extractor.extract_film_ids(producer.film_ids_query, sorted(ids)):
+                film_ids.update(batch)
+        elif producer is not None or table == "film_work":
+            film_ids |= ids
+        else:
+            logger.warning(f"Ignoring changes from unknown table {table}.")
+    return film_ids
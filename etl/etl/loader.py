@@ -1,48 +1,353 @@
 # etl/loader.py
+import copy
+import json
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from collections import deque
+from contextlib import contextmanager
 from elasticsearch import Elasticsearch, ConflictError
-from elasticsearch.helpers import bulk
-from typing import List, Dict, Any
+from elasticsearch.helpers import scan
+import orjson
+from typing import List, Dict, Any, Generator, Iterable, Iterator, Tuple, Optional, Union
 from .utils import backoff # Импортируем универсальный декоратор
 from .config import settings
 from .index_mapping import INDEX_MAPPING_BODY
+from .dead_letters import DeadLetterQueue
+from .batching import AdaptiveBatchSize, split_by_size
+from .metrics import BULK_BYTES, BULK_ITEMS, QUEUE_DEPTH, observe_stage
 import logging
 
 logger = logging.getLogger(__name__)
 
+def versioned_index_name(alias: str) -> str:
+    """Имя новой версии индекса алиаса alias: <alias>_<метка времени UTC до микросекунд>.
+
+    Микросекунды нужны, чтобы две версии, созданные в одну секунду (быстрый перезапуск full_load,
+    первая сборка производного индекса), не столкнулись с resource_already_exists_exception.
+    """
+    return f"{alias}_{datetime.utcnow():%Y%m%d%H%M%S%f}"
+
+def is_versioned_index(index: str, alias: str) -> bool:
+    """Имя index - версия алиаса alias, созданная ETL (versioned_index_name или прежние метки до секунд),
+    а не чужой индекс с тем же префиксом."""
+    return re.fullmatch(re.escape(alias) + r"_\d{14}(\d{6})?", index) is not None
+
+def refresh_policy(value: str) -> Union[bool, str]:
+    """Переводит строковую настройку refresh ('true', 'false', 'wait_for') в параметр bulk."""
+    value = value.strip().lower()
+    if value == "wait_for":
+        return "wait_for"
+    return value == "true"
+
+# Статусы элемента _bulk, при которых документ стоит отправить повторно: кластер перегружен
+RETRYABLE_STATUSES = {429, 503}
+
+# Документ, готовый для тела _bulk: (id, текст JSON)
+SerializedDocument = Tuple[str, str]
+# Исход документа: True - проиндексирован, False - в очереди недоставленных, None - не принят
+Outcome = Optional[bool]
+# Время жизни point in time между страницами scan_sorted
+PIT_KEEP_ALIVE = "5m"
+
+def serialize_documents(documents: Iterable[Dict[str, Any]]) -> List[SerializedDocument]:
+    return [(doc["id"], orjson.dumps(doc).decode()) for doc in documents]
+
+def build_ndjson(documents: List[SerializedDocument], index: str) -> bytes:
+    """Тело _bulk из пар (id, документ в виде текста JSON) без промежуточных словарей."""
+    header = '{"index":{"_index":' + json.dumps(index) + ',"_id":"'
+    return "".join([f'{header}{doc_id}"}}}}\n{document}\n' for doc_id, document in documents]).encode("utf-8")
+
+def document_sizes(documents: List[SerializedDocument]) -> List[int]:
+    """Примерный размер каждого документа в теле _bulk (строка действия и документ)."""
+    return [len(doc_id) + len(document) + 64 for doc_id, document in documents]
+
+def bulk_chunk_size() -> AdaptiveBatchSize:
+    return AdaptiveBatchSize(
+        "bulk_chunk", settings.bulk_chunk_size, settings.bulk_chunk_min, settings.bulk_chunk_max,
+        settings.bulk_target_seconds, settings.bulk_max_chunk_bytes,
+    )
+
+def item_retry_delay(attempt: int) -> float:
+    """Задержка перед повтором номер attempt: экспонента с полным джиттером, чтобы повторы не шли залпом."""
+    return random.uniform(0, min(settings.bulk_retry_max_delay, settings.bulk_retry_base_delay * 2 ** attempt))
+
+def classify_items(pending: List[int], items: List[Dict[str, Any]], documents: List[SerializedDocument],
+                   outcome: List[Outcome], index: str, dead_letters: DeadLetterQueue) -> List[int]:
+    """Разбирает ответы _bulk для документов с позициями pending; возвращает позиции для повтора."""
+    retry = []
+    rejected = []
+    indexed = 0
+    for position, item in zip(pending, items):
+        status = item.get("status", 500)
+        if status < 300:
+            outcome[position] = True
+            indexed += 1
+        elif status in RETRYABLE_STATUSES:
+            retry.append(position)
+        else:
+            doc_id, document = documents[position]
+            logger.error(f"Document {doc_id} rejected by {index} with status {status}: {item.get('error')}")
+            rejected.append((doc_id, index, status, item.get("error"), document))
+            outcome[position] = False
+    BULK_ITEMS.labels("indexed").inc(indexed)
+    BULK_ITEMS.labels("throttled").inc(len(retry))
+    if rejected:
+        BULK_ITEMS.labels("rejected").inc(len(rejected))
+        dead_letters.add(rejected)
+    return retry
+
+def observe_bulk(seconds: float, documents: int, nbytes: int):
+    observe_stage("bulk", seconds, documents)
+    BULK_BYTES.inc(nbytes)
+
+# Запрос, который должен выполнить загрузчик: (пауза перед ним в секундах, тело _bulk)
+BulkRequest = Tuple[float, bytes]
+
+def bulk_exchange(documents: List[SerializedDocument], index: str, chunk_size: AdaptiveBatchSize,
+                  dead_letters: DeadLetterQueue) -> Generator[BulkRequest, Tuple[List[Dict[str, Any]], float], List[Outcome]]:
+    """Загрузка пачки без ввода-вывода: куски, повторы 429/503, разбор ответов и метрики.
+
+    Генератор отдаёт запросы (пауза, тело _bulk) и принимает через send пару (ответы по элементам,
+    длительность запроса); по завершении возвращает исходы по документам. Синхронный и асинхронный
+    загрузчики только ждут паузу и отправляют тело, поэтому ведут себя одинаково.
+    """
+    outcome: List[Outcome] = [None] * len(documents)
+    sizes = document_sizes(documents)
+    for chunk in split_by_size(sizes, chunk_size.value, settings.bulk_max_chunk_bytes):
+        pending = list(chunk)
+        nbytes = sum(sizes[position] for position in pending)
+        for attempt in range(settings.bulk_item_retries + 1):
+            delay = 0.0
+            if attempt:
+                delay = item_retry_delay(attempt)
+                logger.warning(f"Retrying {len(pending)} throttled documents in {delay:.2f}s (attempt {attempt})...")
+            items, elapsed = yield delay, build_ndjson([documents[position] for position in pending], index)
+            observe_bulk(elapsed, len(pending), nbytes if not attempt else sum(sizes[position] for position in pending))
+            retry = classify_items(pending, items, documents, outcome, index, dead_letters)
+            if not attempt:
+                chunk_size.observe(len(pending), elapsed, nbytes, rejected=len(retry))
+            pending = retry
+            if not pending:
+                break
+        if pending:
+            BULK_ITEMS.labels("failed").inc(len(pending))
+            logger.error(f"{len(pending)} documents were not accepted by {index} after {settings.bulk_item_retries} retries.")
+    return outcome
+
+def contiguous_handled(outcome: List[Outcome]) -> int:
+    """Число документов с начала пачки, после которых можно сдвинуть контрольную точку.
+
+    Отвергнутые документы лежат в очереди недоставленных и точку не держат; непринятые - держат.
+    """
+    return outcome.index(None) if None in outcome else len(outcome)
+
 class ElasticLoader:
-    def __init__(self):
-        self.client = Elasticsearch(hosts=[str(settings.elastic_host)], max_retries=3, retry_on_timeout=True)
-        self.index_name = settings.elastic_index
+    """Загрузчик одного индекса: по умолчанию movies, для производных индексов - свой алиас и маппинг."""
+
+    def __init__(self, index_name: Optional[str] = None, mapping: Optional[Dict[str, Any]] = None):
+        self.client = Elasticsearch(
+            hosts=[str(settings.elastic_host)], max_retries=3, retry_on_timeout=True,
+            # Сжатие gzip тел запросов: заметно уменьшает трафик _bulk
+            http_compress=settings.es_http_compress,
+        )
+        self.index_name = index_name or settings.elastic_index
+        self.mapping = mapping or INDEX_MAPPING_BODY
+        self.dead_letters = DeadLetterQueue()
+        # Число документов в одном запросе _bulk подстраивается под задержку, объём и отказы
+        self.chunk_size = bulk_chunk_size()
 
     @backoff # Применяем универсальный декоратор
-    def load(self, documents: List[Dict[str, Any]]):
+    def _send_ndjson(self, body: bytes, refresh: Union[bool, str] = False) -> List[Dict[str, Any]]:
+        """Один запрос _bulk; возвращает ответы по элементам в порядке документов."""
+        response = self.client.bulk(
+            body=body, refresh=refresh, request_timeout=60,
+            # Из ответа нужны только статусы и ошибки
+            filter_path="items.*.status,items.*.error",
+        )
+        return [next(iter(item.values())) for item in response.get("items", [])]
+
+    def index_documents(self, documents: List[SerializedDocument], index: Optional[str] = None,
+                        refresh: Union[bool, str] = False) -> List[Outcome]:
+        """Индексирует пары (id, документ в виде текста JSON) с разбором ответа по каждому документу.
+
+        Документы уходят кусками по chunk_size штук и не больше bulk_max_chunk_bytes байт.
+        429 и 503 - перегрузка: такие документы повторяются отдельно, с экспоненциальной задержкой и джиттером.
+        Остальные отказы (ошибки маппинга, разбора) повторять бесполезно - они уходят в очередь недоставленных.
+        Возвращает исход для каждого документа: True - проиндексирован, False - в очереди недоставленных,
+        None - не принят и после всех повторов.
+        """
+        index = index or self.index_name
+        exchange = bulk_exchange(documents, index, self.chunk_size, self.dead_letters)
+        try:
+            delay, body = next(exchange)
+            while True:
+                if delay:
+                    time.sleep(delay)
+                started = time.monotonic()
+                items = self._send_ndjson(body, refresh)
+                delay, body = exchange.send((items, time.monotonic() - started))
+        except StopIteration as done:
+            return done.value
+
+    def load(self, documents: List[Dict[str, Any]], index: Optional[str] = None) -> List[Outcome]:
+        """Инкрементальная загрузка пачки; видимость документов задаётся es_incremental_refresh.
+
+        Возвращает исходы по документам, как index_documents.
+        """
         if not documents:
             logger.info("No documents to load.")
-            return
-
-        actions = [
-            {
-                "_index": self.index_name,
-                "_id": doc["id"],
-                "_source": doc,
-            }
-            for doc in documents
-        ]
-
-        success_count, failed_items = bulk(self.client, actions, refresh='wait_for', max_retries=3, initial_backoff=1, request_timeout=60)
-        logger.info(f"Successfully loaded {success_count} documents into {self.index_name}. Failed: {len(failed_items)}")
-        if failed_items:
-            logger.error(f"Failed to load {len(failed_items)} documents: {failed_items}")
+            return []
+
+        index = index or self.index_name
+        outcome = self.index_documents(
+            serialize_documents(documents), index, refresh=refresh_policy(settings.es_incremental_refresh),
+        )
+        logger.info(f"Successfully loaded {outcome.count(True)} documents into {index}. Failed: {len(outcome) - outcome.count(True)}")
+        return outcome
+
+    def load_batches(self, batches: Iterable[Tuple[List[Dict[str, Any]], Any]], index: Optional[str] = None) -> Iterator[Tuple[Any, List[Outcome]]]:
+        """Загрузка для полной перезагрузки: как load_ndjson_batches, но из словарей документов."""
+        return self.load_ndjson_batches(((serialize_documents(documents), marker) for documents, marker in batches), index)
+
+    def load_ndjson_batches(self, batches: Iterable[Tuple[List[SerializedDocument], Any]], index: Optional[str] = None) -> Iterator[Tuple[Any, List[Outcome]]]:
+        """Быстрая загрузка готовых JSON-документов: каждая пачка уходит одним запросом _bulk.
+
+        До bulk_workers пачек обрабатываются параллельно; для каждой отдаются (метка, исходы по документам)
+        в исходном порядке пачек, чтобы вызывающий сдвигал контрольную точку только по порядку.
+        """
+        index = index or self.index_name
+        in_flight = deque()
+
+        with ThreadPoolExecutor(max_workers=settings.bulk_workers) as executor:
+            for documents, marker in batches:
+                in_flight.append((marker, executor.submit(self.index_documents, documents, index)))
+                QUEUE_DEPTH.labels("bulk_in_flight").set(len(in_flight))
+                # Ограничиваем число запросов в полёте, чтобы не читать Postgres быстрее, чем пишет Elasticsearch
+                while len(in_flight) >= settings.bulk_workers:
+                    marker, future = in_flight.popleft()
+                    yield marker, future.result()
+            while in_flight:
+                marker, future = in_flight.popleft()
+                yield marker, future.result()
+
+    def scan_documents(self, index: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Читает все документы индекса через scroll."""
+        index = index or self.index_name
+        for hit in scan(self.client, index=index, query={"query": {"match_all": {}}}, size=1000):
+            yield hit["_source"]
+
+    @backoff
+    def _search_page(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        return self.client.search(
+            body=body, request_timeout=60, filter_path="pit_id,hits.hits._id,hits.hits._source,hits.hits.sort",
+        )
+
+    def scan_sorted(self, index: Optional[str] = None, page_size: int = 1000) -> Iterator[List[Tuple[str, Dict[str, Any]]]]:
+        """Все документы индекса страницами пар (id, _source) по возрастанию поля id.
+
+        Страницы читаются через point in time и search_after: в отличие от scroll, порядок задаётся
+        сортировкой без глубокой пагинации, а снимок индекса не меняется, пока его читают.
+        """
+        index = index or self.index_name
+        pit_id = self.client.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE)["id"]
+        body: Dict[str, Any] = {"size": page_size, "sort": [{"id": "asc"}], "track_total_hits": False}
+        try:
+            while True:
+                body["pit"] = {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE}
+                response = self._search_page(body)
+                pit_id = response.get("pit_id", pit_id)
+                hits = response.get("hits", {}).get("hits", [])
+                if not hits:
+                    return
+                yield [(hit["_id"], hit["_source"]) for hit in hits]
+                body["search_after"] = hits[-1]["sort"]
+        finally:
+            self.client.close_point_in_time(body={"id": pit_id})
+
+    def delete_documents(self, ids: List[str], index: Optional[str] = None) -> List[Outcome]:
+        """Удаляет документы по id одним запросом _bulk.
+
+        Возвращает исход для каждого id: True - удалён или его уже не было, None - не удалён.
+        """
+        if not ids:
+            return []
+        index = index or self.index_name
+        header = '{"delete":{"_index":' + json.dumps(index) + ',"_id":"'
+        body = "".join([f'{header}{doc_id}"}}}}\n' for doc_id in ids]).encode("utf-8")
+        items = self._send_ndjson(body, refresh_policy(settings.es_incremental_refresh))
+        outcome: List[Outcome] = [True if item.get("status") in (200, 404) else None for item in items]
+        failed = outcome.count(None)
+        if failed:
+            logger.error(f"{failed} documents were not deleted from {index}: {items[outcome.index(None)].get('error')}")
+        logger.info(f"Deleted {len(ids) - failed} documents from {index}.")
+        return outcome
+
+    def _serving_settings(self) -> Dict[str, Any]:
+        """Настройки индекса, под которым он обслуживает поиск."""
+        return {
+            "refresh_interval": self.mapping["settings"]["refresh_interval"],
+            "number_of_replicas": settings.es_number_of_replicas,
+        }
+
+    @contextmanager
+    def bulk_indexing(self, index: Optional[str] = None):
+        """На время полной загрузки отключает refresh и реплики; затем восстанавливает их и делает один refresh."""
+        index = index or self.index_name
+        self.client.indices.put_settings(index=index, body={"index": {"refresh_interval": "-1", "number_of_replicas": 0}})
+        logger.info(f"Bulk indexing settings applied to {index}.")
+        try:
+            yield
+        finally:
+            self.client.indices.put_settings(index=index, body={"index": self._serving_settings()})
+            self.client.indices.refresh(index=index)
+            logger.info(f"Index {index} settings restored and refreshed.")
+
+    def _create_index(self, index: str, index_settings: Dict[str, Any]):
+        body = copy.deepcopy(self.mapping)
+        body["settings"].update(index_settings)
+        self.client.indices.create(index=index, body=body)
+
+    def create_versioned_index(self) -> str:
+        """Создаёт новый индекс с меткой времени в имени и настройками для массовой загрузки."""
+        index = versioned_index_name(self.index_name)
+        self._create_index(index, {"refresh_interval": "-1", "number_of_replicas": 0})
+        logger.info(f"Index {index} created for full load.")
+        return index
+
+    def count(self, index: Optional[str] = None) -> int:
+        index = index or self.index_name
+        self.client.indices.refresh(index=index)
+        return self.client.count(index=index)["count"]
+
+    def swap_alias(self, new_index: str):
+        """Одним вызовом _aliases переключает алиас на new_index, затем удаляет старые версии индекса."""
+        alias = self.index_name
+        actions = []
+        if self.client.indices.exists_alias(name=alias):
+            old_indices = list(self.client.indices.get_alias(name=alias).keys())
+            actions.extend({"remove": {"index": old, "alias": alias}} for old in old_indices if old != new_index)
+        elif self.client.indices.exists(index=alias):
+            # Индекс из старых версий ETL занимает имя алиаса: удаляем его в том же атомарном запросе
+            actions.append({"remove_index": {"index": alias}})
+        actions.append({"add": {"index": new_index, "alias": alias}})
+        self.client.indices.update_aliases(body={"actions": actions})
+        logger.info(f"Alias {alias} now points to {new_index}.")
+
+        # Удаляем все прежние версии, включая оставшиеся от прерванных загрузок; чужие индексы
+        # с тем же префиксом (movies_backup, восстановленные из снапшота) не трогаем
+        for old in self.client.indices.get(index=f"{alias}_*").keys():
+            if old != new_index and is_versioned_index(old, alias):
+                self.client.indices.delete(index=old)
+                logger.info(f"Old index {old} deleted.")
 
     def create_index_if_not_exists(self):
         if not self.client.indices.exists(index=self.index_name):
-            self.client.indices.create(index=self.index_name, body=INDEX_MAPPING_BODY)
-            logger.info(f"Index {self.index_name} created with predefined mapping.")
+            index = versioned_index_name(self.index_name)
+            self._create_index(index, self._serving_settings())
+            self.client.indices.update_aliases(body={"actions": [{"add": {"index": index, "alias": self.index_name}}]})
+            logger.info(f"Index {index} created with predefined mapping, alias {self.index_name} added.")
         else:
             logger.info(f"Index {self.index_name} already exists.")
-
-    def clear_index(self):
-        if self.client.indices.exists(index=self.index_name):
-            self.client.indices.delete(index=self.index_name)
-            logger.info(f"Index {self.index_name} deleted.")
-        self.create_index_if_not_exists()
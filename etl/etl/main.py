@@ -1,100 +1,704 @@
+import asyncio
 import logging
 import os
 import time
 from datetime import datetime
-from .extractor import PostgresExtractor
+from functools import partial
+from itertools import chain
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+import psycopg2
+from .extractor import PostgresExtractor, Cursor, INITIAL_CURSOR, row_cursor
+from .async_extractor import AsyncPostgresExtractor
 from .transformer import transform_movies
-from .loader import ElasticLoader
+from .loader import ElasticLoader, Outcome, contiguous_handled
+from .async_loader import AsyncElasticLoader
+from .producers import DEPENDENCY_PRODUCERS
+from .partitions import MAX_ID, MIN_ID, run_partitioned_load, reset_partition_states
+from .queries import FILM_WORK_HEAD_QUERY, EXTRACT_FILMWORK_BY_IDS_QUERY
 from .state import State
+from .hash_store import DocumentHashStore
 from .config import settings
+from .migrate import apply_migrations
+from .listener import ChangeListener, ChangeBatcher, resolve_film_ids
+from .targets import IndexTarget, index_targets
+from .verify import MISSING, ORPHANED, STALE, IdHash, diff_sorted, document_hashes, index_hashes, source_hashes
+from .metrics import QUEUE_DEPTH, mark_caught_up, mark_stalled, observe_freshness, sampled_profile, start_metrics_server, timed_stage
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Ключ состояния с курсором keyset-пагинации по film_work
+FILM_WORK_CURSOR_KEY = 'film_work_cursor'
+# Сколько id каждого вида расхождений режим verify выписывает в лог
+VERIFY_EXAMPLES = 10
+# Ключи незавершённой полной загрузки: целевой индекс, число партиций и конец film_work на момент старта
+FULL_LOAD_INDEX_KEY = 'full_load_index'
+FULL_LOAD_WORKERS_KEY = 'full_load_workers'
+FULL_LOAD_HEAD_KEY = 'full_load_head'
+
+def load_film_work_cursor(state_manager: State) -> Cursor:
+    """Курсор из состояния; для старых файлов состояния берём только last_processed_modified."""
+    cursor = state_manager.get_cursor(FILM_WORK_CURSOR_KEY)
+    if cursor is not None:
+        return cursor
+    legacy_modified = state_manager.get_value('last_processed_modified')
+    if legacy_modified is not None:
+        return legacy_modified, INITIAL_CURSOR[1]
+    return INITIAL_CURSOR
+
+def changed_positions(documents: List[Dict[str, Any]], hash_store: Optional[DocumentHashStore]) -> List[int]:
+    """Позиции документов, которые отличаются от последней проиндексированной версии."""
+    if hash_store is None:
+        return list(range(len(documents)))
+    changed_ids = {doc["id"] for doc in hash_store.filter_changed(documents)}
+    if len(changed_ids) < len(documents):
+        logger.info(f"Skipped {len(documents) - len(changed_ids)} unchanged documents.")
+    return [position for position, doc in enumerate(documents) if doc["id"] in changed_ids]
+
+def merge_outcome(documents: List[Dict[str, Any]], positions: List[int], sent_outcome: List[Outcome],
+                  hash_store: Optional[DocumentHashStore]) -> List[Outcome]:
+    """Исходы для всей пачки: пропущенные неизменившиеся документы считаются проиндексированными.
+
+    Хеши запоминаются только для документов, которые Elasticsearch принял.
+    """
+    outcome: List[Outcome] = [True] * len(documents)
+    for position, result in zip(positions, sent_outcome):
+        outcome[position] = result
+    if hash_store is not None:
+        hash_store.remember([documents[position] for position, result in zip(positions, sent_outcome) if result])
+    return outcome
+
+def load_documents(documents: List[Dict[str, Any]], loader: ElasticLoader,
+                   hash_store: Optional[DocumentHashStore] = None, index: Optional[str] = None) -> List[Outcome]:
+    """Загружает документы, пропуская те, что совпадают с последней проиндексированной версией.
+
+    Возвращает исход для каждого документа пачки (см. ElasticLoader.index_documents).
+    """
+    positions = changed_positions(documents, hash_store)
+    sent_outcome = loader.load([documents[position] for position in positions], index=index)
+    return merge_outcome(documents, positions, sent_outcome, hash_store)
+
+def process_batches(batches: Iterable[List[Dict[str, Any]]], loader: ElasticLoader, state_manager: State,
+                    index: Optional[str] = None, hash_store: Optional[DocumentHashStore] = None) -> Tuple[int, bool]:
+    """Трансформирует и загружает каждую пачку сразу после извлечения, сохраняя состояние после каждой.
+
+    Курсор сдвигается только до последнего документа непрерывной последовательности принятых;
+    на первом непринятом документе проход останавливается - следующий начнётся с него.
+    Возвращает число загруженных строк и признак такой остановки: ноль строк ещё не значит, что новых данных нет.
+    """
+    total = 0
+    for raw_batch in batches:
+        logger.info(f"Extracted batch of {len(raw_batch)} records.")
+        with sampled_profile():
+            with timed_stage("transform", len(raw_batch)):
+                transformed_batch = transform_movies(raw_batch)
+            handled = contiguous_handled(load_documents(transformed_batch, loader, hash_store, index=index))
+
+        # Сохраняем курсор последней загруженной записи,
+        # чтобы после перезапуска продолжить со следующей пачки
+        if handled:
+            cursor = row_cursor(raw_batch[handled - 1])
+            state_manager.set_cursor(FILM_WORK_CURSOR_KEY, cursor)
+            observe_freshness(raw_batch[handled - 1]['modified'])
+            logger.info(f"Updated film_work cursor: {cursor}")
+        total += handled
+        if handled < len(raw_batch):
+            logger.warning(f"Film {raw_batch[handled]['id']} was not accepted by Elasticsearch, stopping until the next pass.")
+            mark_stalled(raw_batch[handled]['modified'])
+            return total, True
+    return total, False
+
+def report_pass(processed: int, stalled: bool):
+    """Итог прохода по film_work в логе и метрике свежести.
+
+    Проход, остановленный непринятым документом, не догнал Postgres, даже если не загрузил ни одной строки.
+    """
+    if processed:
+        logger.info(f"Processed {processed} new/updated records.")
+    if stalled:
+        return
+    mark_caught_up()
+    if not processed:
+        logger.info("No new data found.")
+
+async def process_batches_async(extractor: AsyncPostgresExtractor, loader: AsyncElasticLoader, state_manager: State,
+                                start_cursor: Cursor, hash_store: Optional[DocumentHashStore] = None) -> Tuple[int, bool]:
+    """Асинхронный аналог process_batches: извлечение, трансформация и загрузка идут параллельно.
+
+    Этапы связаны очередями размером async_queue_size: следующая страница читается из Postgres,
+    пока предыдущая индексируется. Заполненная очередь приостанавливает предыдущий этап (backpressure).
+    Загрузчик один, поэтому курсор по-прежнему сохраняется строго по порядку пачек;
+    на первом непринятом документе загрузчик останавливает остальные этапы, как process_batches.
+    """
+    pages: asyncio.Queue = asyncio.Queue(maxsize=settings.async_queue_size)
+    documents: asyncio.Queue = asyncio.Queue(maxsize=settings.async_queue_size)
+    total = 0
+    stalled = False
+
+    async def extract():
+        async for raw_batch in extractor.extract_batches(start_cursor=start_cursor):
+            logger.info(f"Extracted batch of {len(raw_batch)} records.")
+            await pages.put(raw_batch)
+            QUEUE_DEPTH.labels("async_pages").set(pages.qsize())
+        await pages.put(None)
+
+    async def transform():
+        while (raw_batch := await pages.get()) is not None:
+            with timed_stage("transform", len(raw_batch)):
+                transformed_batch = transform_movies(raw_batch)
+            await documents.put((transformed_batch, raw_batch))
+            QUEUE_DEPTH.labels("async_documents").set(documents.qsize())
+        await documents.put(None)
+
+    upstream: List[asyncio.Task] = []
+
+    async def load():
+        nonlocal total, stalled
+        while (item := await documents.get()) is not None:
+            transformed_batch, raw_batch = item
+            positions = changed_positions(transformed_batch, hash_store)
+            sent_outcome = await loader.load([transformed_batch[position] for position in positions])
+            handled = contiguous_handled(merge_outcome(transformed_batch, positions, sent_outcome, hash_store))
+            if handled:
+                cursor = row_cursor(raw_batch[handled - 1])
+                state_manager.set_cursor(FILM_WORK_CURSOR_KEY, cursor)
+                observe_freshness(raw_batch[handled - 1]['modified'])
+                logger.info(f"Updated film_work cursor: {cursor}")
+            total += handled
+            if handled < len(raw_batch):
+                logger.warning(f"Film {raw_batch[handled]['id']} was not accepted by Elasticsearch, stopping until the next pass.")
+                mark_stalled(raw_batch[handled]['modified'])
+                stalled = True
+                for task in upstream:
+                    task.cancel()
+                return
+
+    # Ошибка любого этапа отменяет остальные; курсор остаётся на последней загруженной пачке
+    async with asyncio.TaskGroup() as group:
+        upstream.append(group.create_task(extract()))
+        upstream.append(group.create_task(transform()))
+        group.create_task(load())
+    return total, stalled
+
+def delete_missing(ids: List[str], documents: List[Dict[str, Any]], loader: ElasticLoader,
+                   hash_store: Optional[DocumentHashStore] = None) -> Tuple[int, List[str]]:
+    """Удаляет из индекса документы с id, для которых Postgres не вернул документа в documents.
+
+    Записи больше нет или она больше не попадает в индекс (например, у персоны не осталось имени).
+    Возвращает число удалённых документов и id, которые удалить не удалось.
+    """
+    found = {doc["id"] for doc in documents}
+    gone = [doc_id for doc_id in ids if doc_id not in found]
+    if not gone:
+        return 0, []
+    outcome = loader.delete_documents(gone)
+    if hash_store is not None:
+        hash_store.forget(doc_id for doc_id, result in zip(gone, outcome) if result)
+    return outcome.count(True), [doc_id for doc_id, result in zip(gone, outcome) if result is None]
+
+def reindex_films(film_ids: List[str], extractor: PostgresExtractor, loader: ElasticLoader,
+                  hash_store: Optional[DocumentHashStore] = None) -> Tuple[int, List[str]]:
+    """Перестраивает документы фильмов с заданными id пачками по batch_size.
+
+    Документы фильмов, которых больше нет в Postgres (уведомление об удалении), удаляются из индекса.
+    Возвращает число перестроенных документов и id фильмов, которые Elasticsearch так и не принял.
+    """
+    total = 0
+    failed_ids: List[str] = []
+    for start in range(0, len(film_ids), extractor.batch_size):
+        chunk = film_ids[start:start + extractor.batch_size]
+        raw_batch = extractor.extract_by_ids(chunk)
+        documents: List[Dict[str, Any]] = []
+        if raw_batch:
+            with timed_stage("reindex", len(raw_batch)):
+                documents = transform_movies(raw_batch)
+                outcome = load_documents(documents, loader, hash_store)
+            failed_ids.extend(doc["id"] for doc, result in zip(documents, outcome) if result is None)
+            total += len(raw_batch)
+        _, failed = delete_missing(chunk, documents, loader, hash_store)
+        failed_ids.extend(failed)
+    return total, failed_ids
+
+def reindex_target(target: IndexTarget, ids: List[str], extractor: PostgresExtractor,
+                   hash_store: Optional[DocumentHashStore] = None) -> Tuple[int, List[str]]:
+    """Перестраивает документы производного индекса с заданными id, как reindex_films.
+
+    Документы удалённых из Postgres персон и жанров удаляются из индекса.
+    """
+    total = 0
+    failed_ids: List[str] = []
+    for start in range(0, len(ids), extractor.batch_size):
+        chunk = ids[start:start + extractor.batch_size]
+        rows = extractor.extract_by_ids(chunk, target.by_ids_query)
+        documents: List[Dict[str, Any]] = []
+        if rows:
+            with timed_stage(f"{target.name}_reindex", len(rows)):
+                documents = target.transform(rows)
+                outcome = load_documents(documents, target.loader, hash_store)
+            failed_ids.extend(doc["id"] for doc, result in zip(documents, outcome) if result is None)
+            total += len(rows)
+        _, failed = delete_missing(chunk, documents, target.loader, hash_store)
+        failed_ids.extend(failed)
+    return total, failed_ids
+
+def process_targets(targets: Sequence[IndexTarget], changes: Dict[str, List[Dict[str, Any]]], extractor: PostgresExtractor,
+                    hash_store: Optional[DocumentHashStore] = None) -> Tuple[int, bool]:
+    """Перестраивает документы производных индексов по страницам изменений, уже прочитанным для movies.
+
+    Возвращает число перестроенных документов и признак, что Elasticsearch принял их все.
+    """
+    total = 0
+    accepted = True
+    for target in targets:
+        ids = target.affected_ids(changes)
+        if not ids:
+            continue
+        reindexed, failed_ids = reindex_target(target, sorted(ids), extractor, hash_store)
+        total += reindexed
+        if failed_ids:
+            logger.warning(f"{len(failed_ids)} documents were not accepted by {target.index_name}.")
+            accepted = False
+        else:
+            logger.info(f"Reindexed {reindexed} documents in {target.index_name} affected by dependency changes.")
+    return total, accepted
+
+def build_target_index(target: IndexTarget, extractor: PostgresExtractor,
+                       hash_store: Optional[DocumentHashStore] = None) -> int:
+    """Полная перестройка производного индекса: новый версионный индекс, загрузка страницами по id и переключение алиаса.
+
+    Персон и жанров много меньше, чем строк связей фильмов, поэтому прерванная перестройка просто начинается заново.
+    """
+    loader = target.loader
+    new_index = loader.create_versioned_index()
+    total = 0
+    with loader.bulk_indexing(new_index):
+        pages = (target.transform(rows) for rows in extractor.extract_id_pages(target.page_query))
+        # Метка пачки - сами документы: хеши запоминаются только для принятых
+        for documents, outcome in loader.load_batches(((documents, documents) for documents in pages), index=new_index):
+            if None in outcome:
+                raise RuntimeError(
+                    f"{outcome.count(None)} documents were not accepted by {new_index}; alias {loader.index_name} left unchanged."
+                )
+            if hash_store is not None:
+                hash_store.remember([doc for doc, result in zip(documents, outcome) if result])
+            total += outcome.count(True)
+    loader.swap_alias(new_index)
+    logger.info(f"Index {new_index} built with {total} documents.")
+    return total
+
+def ensure_target_indices(targets: Sequence[IndexTarget], extractor: PostgresExtractor,
+                          hash_store: Optional[DocumentHashStore] = None):
+    """Строит производные индексы, которых ещё нет: первый запуск или новое имя в extra_indices."""
+    for target in targets:
+        if not target.loader.client.indices.exists(index=target.index_name):
+            logger.info(f"Index {target.index_name} not found, building it from Postgres...")
+            build_target_index(target, extractor, hash_store)
+
+def init_dependency_cursors(extractor: PostgresExtractor, state_manager: State, overwrite: bool = False):
+    """Ставит курсоры зависимых таблиц на их текущий конец, чтобы не переиндексировать всё заново."""
+    for producer in DEPENDENCY_PRODUCERS:
+        if not overwrite and state_manager.get_cursor(producer.state_key) is not None:
+            continue
+        head = extractor.extract_head(producer.head_query) or INITIAL_CURSOR
+        state_manager.set_cursor(producer.state_key, head)
+        logger.info(f"Initialized {producer.state_key}: {head}")
+
+def process_dependencies(extractor: PostgresExtractor, loader: ElasticLoader, state_manager: State,
+                         hash_store: Optional[DocumentHashStore] = None, targets: Sequence[IndexTarget] = ()) -> int:
+    """Переиндексирует фильмы, затронутые изменениями персон, жанров и связующих таблиц.
+
+    За один проход каждый продюсер читает по странице изменений; id фильмов объединяются,
+    так что фильм, затронутый несколькими изменениями, загружается один раз.
+    Те же страницы изменений перестраивают документы производных индексов (targets).
+    Курсоры продюсеров сохраняются только после загрузки всех затронутых документов:
+    если Elasticsearch принял не все, страница будет прочитана снова в следующем проходе.
+    """
+    total = 0
+    while True:
+        film_ids: Set[str] = set()
+        page_cursors: Dict[str, Cursor] = {}
+        changes: Dict[str, List[Dict[str, Any]]] = {}
+        for producer in DEPENDENCY_PRODUCERS:
+            cursor = state_manager.get_cursor(producer.state_key, default=INITIAL_CURSOR)
+            affected_ids, page_cursor, rows = producer.next_page(extractor, cursor)
+            if page_cursor is not None:
+                film_ids |= affected_ids
+                page_cursors[producer.state_key] = page_cursor
+                changes[producer.name] = rows
+
+        if not page_cursors:
+            return total
+
+        reindexed, failed_ids = reindex_films(sorted(film_ids), extractor, loader, hash_store)
+        total += reindexed
+        if failed_ids:
+            logger.warning(f"{len(failed_ids)} films were not accepted by Elasticsearch, dependency cursors kept.")
+            return total
+        reindexed, accepted = process_targets(targets, changes, extractor, hash_store)
+        total += reindexed
+        if not accepted:
+            logger.warning("Derived indices did not accept all documents, dependency cursors kept.")
+            return total
+        state_manager.set_cursors(page_cursors)
+        logger.info(f"Reindexed {len(film_ids)} films affected by dependency changes.")
+
+def sync_changes(extractor: PostgresExtractor, loader: ElasticLoader, state_manager: State,
+                 hash_store: Optional[DocumentHashStore] = None, targets: Sequence[IndexTarget] = ()) -> int:
+    """Один проход опроса: фильмы после сохранённого курсора и изменения зависимых таблиц."""
+    cursor = load_film_work_cursor(state_manager)
+    logger.info(f"Checking for new data after cursor {cursor}...")
+
+    # Извлекаем, трансформируем и загружаем данные пачками по мере поступления
+    processed, stalled = process_batches(extractor.extract_batches(start_cursor=cursor), loader, state_manager, hash_store=hash_store)
+    report_pass(processed, stalled)
+
+    # Изменения персон, жанров и связей попадают в денормализованные поля фильмов
+    reindexed = process_dependencies(extractor, loader, state_manager, hash_store, targets)
+    if reindexed:
+        logger.info(f"Reindexed {reindexed} records after dependency changes.")
+    return processed + reindexed
+
 def run_etl_loop():
     extractor = PostgresExtractor()
     loader = ElasticLoader()
     state_manager = State()
+    # Хеши уже проиндексированных документов: неизменившиеся документы не отправляются повторно
+    hash_store = DocumentHashStore() if settings.skip_unchanged else None
 
     # Проверяем, нужно ли выполнить полную перезагрузку при старте.
     # Это может быть опционально, например, если индекс пуст или если задана переменная окружения.
     # Для простоты, будем считать, что при запуске мы НЕ очищаем индекс и начинаем с последнего сохраненного состояния.
-    # Если состояние отсутствует, начнем с очень ранней даты.
-    initial_start_date = "1900-01-01T00:00:00.000+00:00"
-    last_modified_str = state_manager.get_value('last_processed_modified', default=initial_start_date)
+    # Если состояние отсутствует, начнем с самого начала таблицы.
+    init_dependency_cursors(extractor, state_manager)
+    loader.create_index_if_not_exists()
+    # Производные индексы (genres, persons) обновляются из тех же изменений
+    targets = index_targets()
+    ensure_target_indices(targets, extractor, hash_store)
 
-    logger.info(f"Starting ETL loop, will check for data modified after {last_modified_str}...")
+    logger.info(f"Starting ETL loop, will check for data after cursor {load_film_work_cursor(state_manager)}...")
 
     while True: # Бесконечный цикл
-        logger.info(f"Checking for new data modified after {last_modified_str}...")
-
-        # Извлекаем данные, измененные после last_modified_str
-        raw_data = extractor.extract_all(start_modified=last_modified_str)
-
-        if raw_data: # Исправлено: raw_data, а не raw_
-            logger.info(f"Found {len(raw_data)} new/updated records.")
-            # Трансформируем данные
-            logger.info("Starting transformation...")
-            transformed_data = transform_movies(raw_data)
-            logger.info(f"Transformed {len(transformed_data)} records.")
-
-            # Загружаем данные в Elasticsearch
-            logger.info("Starting loading into Elasticsearch...")
-            loader.load(transformed_data)
-            logger.info("Loading completed.")
-
-            # Находим самую последнюю дату модификации в загруженных данных
-            latest_modified = max(row['modified'] for row in raw_data)
-            latest_modified_iso = latest_modified.isoformat()
-            # Сохраняем эту дату в состояние
-            state_manager.set_value('last_processed_modified', latest_modified_iso)
-            logger.info(f"Updated last processed modified time: {latest_modified_iso}")
-            last_modified_str = latest_modified_iso
-        else:
-            logger.info("No new data found.")
+        sync_changes(extractor, loader, state_manager, hash_store, targets)
 
         logger.info(f"Sleeping for {settings.poll_delay} seconds...")
         time.sleep(settings.poll_delay)
 
+async def run_async_etl_loop():
+    """Цикл опроса на asyncio (async_engine=true): этапы фильмов перекрываются во времени.
+
+    Создание индекса и переиндексация по зависимым таблицам выполняются синхронными
+    PostgresExtractor и ElasticLoader - в этот момент других задач в цикле событий нет.
+    """
+    extractor = PostgresExtractor()
+    loader = ElasticLoader()
+    async_extractor = AsyncPostgresExtractor()
+    async_loader = AsyncElasticLoader()
+    state_manager = State()
+    hash_store = DocumentHashStore() if settings.skip_unchanged else None
+
+    init_dependency_cursors(extractor, state_manager)
+    loader.create_index_if_not_exists()
+    targets = index_targets()
+    ensure_target_indices(targets, extractor, hash_store)
+    logger.info(f"Starting async ETL loop, will check for data after cursor {load_film_work_cursor(state_manager)}...")
+
+    try:
+        while True:
+            cursor = load_film_work_cursor(state_manager)
+            logger.info(f"Checking for new data after cursor {cursor}...")
+            processed, stalled = await process_batches_async(async_extractor, async_loader, state_manager, cursor, hash_store)
+            report_pass(processed, stalled)
+
+            reindexed = process_dependencies(extractor, loader, state_manager, hash_store, targets)
+            if reindexed:
+                logger.info(f"Reindexed {reindexed} records after dependency changes.")
+
+            logger.info(f"Sleeping for {settings.poll_delay} seconds...")
+            await asyncio.sleep(settings.poll_delay)
+    finally:
+        await async_extractor.close()
+        await async_loader.close()
+
+def run_etl_listen():
+    """Событийный режим: триггеры content.* присылают изменённые id через NOTIFY.
+
+    Изменения копятся короткое время (listen_debounce) и индексируются одной пачкой.
+    Опрос остаётся страховкой: раз в listen_sweep_interval и после каждого переподключения
+    выполняется обычный проход sync_changes - он подхватывает потерянные уведомления и двигает курсоры,
+    а хранилище хешей не даёт повторно отправить уже проиндексированные документы.
+    """
+    extractor = PostgresExtractor()
+    loader = ElasticLoader()
+    state_manager = State()
+    hash_store = DocumentHashStore() if settings.skip_unchanged else None
+    listener = ChangeListener()
+    batcher = ChangeBatcher(settings.listen_debounce, settings.listen_max_delay, settings.listen_max_pending)
+
+    init_dependency_cursors(extractor, state_manager)
+    loader.create_index_if_not_exists()
+    targets = index_targets()
+    ensure_target_indices(targets, extractor, hash_store)
+
+    # LISTEN до первой сверки: изменения между ними придут уведомлениями, а не потеряются
+    if not settings.listen_triggers:
+        logger.warning("listen_triggers is disabled: no change notifications will arrive, only fallback sweeps run.")
+    listener.connect()
+    next_sweep = time.monotonic()
+    logger.info(f"Starting ETL in listen mode, fallback sweep every {settings.listen_sweep_interval} seconds...")
+
+    while True:
+        now = time.monotonic()
+        if now >= next_sweep:
+            sync_changes(extractor, loader, state_manager, hash_store, targets)
+            next_sweep = time.monotonic() + settings.listen_sweep_interval
+            continue
+
+        timeout = next_sweep - now
+        batch_timeout = batcher.timeout(now)
+        if batch_timeout is not None:
+            timeout = min(timeout, batch_timeout)
+        try:
+            batcher.add(listener.poll(timeout), time.monotonic())
+        except psycopg2.OperationalError as e:
+            logger.warning(f"Lost LISTEN connection: {e}. Reconnecting...")
+            listener.connect()
+            # Уведомления за время разрыва потеряны - сверяемся опросом
+            next_sweep = time.monotonic()
+
+        if batcher.due(time.monotonic()):
+            changes = batcher.drain()
+            film_ids = resolve_film_ids(changes, extractor)
+            reindexed, failed_ids = reindex_films(sorted(film_ids), extractor, loader, hash_store)
+            logger.info(f"Reindexed {reindexed} of {len(film_ids)} films from {sum(map(len, changes.values()))} change notifications.")
+            if failed_ids:
+                # Непринятые фильмы возвращаются в пачку и будут отправлены снова
+                batcher.add([("film_work", film_id) for film_id in failed_ids], time.monotonic())
+            for target in targets:
+                target_ids = target.notified_ids(changes)
+                if target_ids:
+                    _, target_failed = reindex_target(target, sorted(target_ids), extractor, hash_store)
+                    if target_failed:
+                        # Курсоры зависимых таблиц двигает только сверка - она и отправит их снова
+                        logger.warning(f"{len(target_failed)} documents were not accepted by {target.index_name}, left to the next sweep.")
+
 def run_etl_initial_load():
-    """Функция для выполнения полной перезагрузки (если требуется)."""
+    """Функция для выполнения полной перезагрузки (если требуется).
+
+    Таблица film_work делится на диапазоны id, которые загружаются параллельно (full_load_workers).
+    Прерванная загрузка при повторном запуске продолжается в тот же индекс с контрольных точек партиций.
+    """
     extractor = PostgresExtractor()
     loader = ElasticLoader()
     state_manager = State()
 
-    state_file_path = state_manager.state_file_path
-    if os.path.exists(state_file_path):
-        os.remove(state_file_path)
-        logger.info(f"State file {state_file_path} removed.")
+    new_index = state_manager.get_value(FULL_LOAD_INDEX_KEY)
+    if new_index and loader.client.indices.exists(index=new_index):
+        workers = state_manager.get_value(FULL_LOAD_WORKERS_KEY)
+        head = state_manager.get_cursor(FULL_LOAD_HEAD_KEY)
+        logger.info(f"Resuming interrupted full load into {new_index} with {workers} partitions...")
     else:
-        logger.info(f"State file {state_file_path} not found, no need to remove.")
+        workers = settings.full_load_workers
+        state_manager.reset()
+        reset_partition_states(workers)
+
+        # Новые данные пишутся в отдельный индекс; поиск продолжает работать со старым через алиас
+        new_index = loader.create_versioned_index()
 
-    loader.clear_index()
+        # Запоминаем конец film_work и зависимых таблиц до начала загрузки: всё, что изменится
+        # во время неё, подхватят догрузка ниже и цикл
+        head = extractor.extract_head(FILM_WORK_HEAD_QUERY) or INITIAL_CURSOR
+        init_dependency_cursors(extractor, state_manager, overwrite=True)
+        # Одной записью: незавершённая загрузка видна после рестарта только вместе со своим head
+        state_manager.set_cursors(
+            {FULL_LOAD_HEAD_KEY: head},
+            values={FULL_LOAD_WORKERS_KEY: workers, FULL_LOAD_INDEX_KEY: new_index},
+        )
 
-    start_date = "1900-01-01T00:00:00.000+00:00"
-    logger.info(f"Starting initial ETL load, extracting data modified after {start_date}...")
+    logger.info(f"Starting initial ETL load into {new_index} with {workers} partitions...")
+    with loader.bulk_indexing(new_index):
+        run_partitioned_load(new_index, workers)
 
-    raw_data = extractor.extract_all(start_modified=start_date)
-    logger.info(f"Extracted {len(raw_data)} raw records for initial load.")
+    # Догоняем фильмы, изменённые или добавленные за время загрузки
+    state_manager.set_cursor(FILM_WORK_CURSOR_KEY, head)
+    caught_up, _ = process_batches(extractor.extract_batches(start_cursor=head), loader, state_manager, index=new_index)
+    logger.info(f"Caught up {caught_up} records changed during the load.")
 
-    if raw_data: 
+    # Переключаем алиас, только если новый индекс содержит все фильмы, кроме отвергнутых (они в очереди недоставленных)
+    expected = extractor.count_films()
+    actual = loader.count(new_index)
+    rejected = loader.dead_letters.count(index=new_index)
+    if actual + rejected < expected:
+        raise RuntimeError(f"Index {new_index} has {actual} documents, Postgres has {expected}; alias left unchanged.")
+    if rejected:
+        logger.warning(f"{rejected} documents were rejected by {new_index}; fix them and run the replay_dead_letters mode.")
+    loader.swap_alias(new_index)
 
-        logger.info("Starting transformation...")
-        transformed_data = transform_movies(raw_data)
-        logger.info(f"Transformed {len(transformed_data)} records.")
+    # Хеши описывали старый индекс; пустое хранилище безопасно - документы просто отправятся при следующем изменении.
+    # Заполнить его сразу можно режимом rebuild_hashes.
+    hash_store = DocumentHashStore() if settings.skip_unchanged else None
+    if hash_store is not None:
+        hash_store.clear()
 
-        logger.info("Starting loading into Elasticsearch...")
-        loader.load(transformed_data)
-        logger.info("Initial ETL load completed successfully.")
+    # Производные индексы перестраиваются целиком; изменения за это время подхватит цикл по курсорам зависимостей
+    for target in index_targets():
+        build_target_index(target, extractor, hash_store)
+    extractor.close()
+    if hash_store is not None:
+        hash_store.close()
 
-        if raw_data:
-            latest_modified = max(row['modified'] for row in raw_data)
-            latest_modified_iso = latest_modified.isoformat()
-            state_manager.set_value('last_processed_modified', latest_modified_iso)
-            logger.info(f"Saved last processed modified time after initial load: {latest_modified_iso}")
+    state_manager.set_value(FULL_LOAD_INDEX_KEY, None)
+    reset_partition_states(workers)
+    if actual:
+        logger.info(f"Initial ETL load completed successfully, {actual} records in {new_index}.")
     else:
         logger.info("No data found for initial load.")
 
+def run_rebuild_hashes():
+    """Перестраивает хранилище хешей по документам, которые сейчас лежат в movies и производных индексах."""
+    loader = ElasticLoader()
+    hash_store = DocumentHashStore()
+    hash_store.rebuild(chain(loader.scan_documents(), *(target.loader.scan_documents() for target in index_targets())))
+    hash_store.close()
+
+def replay_index_dead_letters(loader: ElasticLoader, query: str,
+                              transform: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]], extractor: PostgresExtractor,
+                              hash_store: Optional[DocumentHashStore] = None):
+    """Повторно индексирует документы, отвергнутые алиасом loader.index_name или его версиями."""
+    dead_letters = loader.dead_letters
+    ids = dead_letters.ids(loader.index_name)
+    logger.info(f"Replaying {len(ids)} documents dead-lettered by {loader.index_name}...")
+    for start in range(0, len(ids), extractor.batch_size):
+        chunk = ids[start:start + extractor.batch_size]
+        documents = transform(extractor.extract_by_ids(chunk, query))
+        outcome = load_documents(documents, loader, hash_store)
+        found = {doc["id"] for doc in documents}
+        done = [doc["id"] for doc, result in zip(documents, outcome) if result]
+        dead_letters.remove(done + [doc_id for doc_id in chunk if doc_id not in found])
+
+def run_replay_dead_letters():
+    """Повторно индексирует документы из очереди недоставленных по текущим данным Postgres.
+
+    Запускается после исправления маппинга или данных. Принятые и удалённые из Postgres документы
+    убираются из очереди; отвергнутые снова остаются в ней с новой ошибкой.
+    Документы movies и производных индексов переиндексируются каждый своим запросом и загрузчиком.
+    """
+    extractor = PostgresExtractor()
+    loader = ElasticLoader()
+    hash_store = DocumentHashStore() if settings.skip_unchanged else None
+
+    replay_index_dead_letters(loader, EXTRACT_FILMWORK_BY_IDS_QUERY, transform_movies, extractor, hash_store)
+    for target in index_targets():
+        replay_index_dead_letters(target.loader, target.by_ids_query, target.transform, extractor, hash_store)
+    extractor.close()
+    logger.info(f"Replay finished, {loader.dead_letters.count()} documents remain in the dead-letter queue.")
+
+def repair_documents(ids: List[str], query: str, transform: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]],
+                     extractor: PostgresExtractor, loader: ElasticLoader,
+                     hash_store: Optional[DocumentHashStore] = None) -> Tuple[int, int, List[str]]:
+    """Приводит документы индекса loader к текущим данным Postgres: найденные переиндексируются, остальные удаляются.
+
+    Документы читаются запросом query и собираются transform, как при переиндексации по id.
+    Хранилище хешей при отправке не проверяется - расхождение и означает, что оно не совпадает с индексом.
+    Возвращает число переиндексированных и удалённых документов и id, которые Elasticsearch не принял.
+    """
+    reindexed = deleted = 0
+    failed_ids: List[str] = []
+    for start in range(0, len(ids), extractor.batch_size):
+        chunk = ids[start:start + extractor.batch_size]
+        documents = transform(extractor.extract_by_ids(chunk, query))
+        if documents:
+            with timed_stage("reindex", len(documents)):
+                outcome = merge_outcome(documents, list(range(len(documents))), loader.load(documents), hash_store)
+            failed_ids.extend(doc["id"] for doc, result in zip(documents, outcome) if result is None)
+            reindexed += outcome.count(True)
+        # Записи нет в Postgres и сейчас (а не только на момент чтения потока) - документ удаляется
+        removed, failed = delete_missing(chunk, documents, loader, hash_store)
+        deleted += removed
+        failed_ids.extend(failed)
+    return reindexed, deleted, failed_ids
+
+def target_hashes(target: IndexTarget, extractor: PostgresExtractor) -> Iterator[IdHash]:
+    """(id, хеш) всех документов производного индекса по данным Postgres в порядке id."""
+    return document_hashes(target.transform(rows) for rows in extractor.extract_id_pages(target.page_query))
+
+def verify_index(source: Iterable[IdHash], loader: ElasticLoader,
+                 repair: Optional[Callable[[List[str]], Tuple[int, int, List[str]]]] = None) -> Dict[str, int]:
+    """Сверяет индекс loader.index_name с потоком (id, хеш) документов из Postgres (см. etl.verify).
+
+    С repair расхождения исправляются пачками по verify_page_size прямо во время сверки: repair получает id
+    недостающих, устаревших и лишних документов (см. repair_documents). Point in time индекса эти изменения
+    не видит, поэтому они не влияют на саму сверку. Возвращает счётчики по видам расхождений и исправлений.
+    """
+    counts = {"matched": 0, MISSING: 0, STALE: 0, ORPHANED: 0, "reindexed": 0, "deleted": 0, "failed": 0}
+    examples: Dict[str, List[str]] = {MISSING: [], STALE: [], ORPHANED: []}
+    pending: List[str] = []
+
+    def flush():
+        reindexed, deleted, failed_ids = repair(pending)
+        counts["reindexed"] += reindexed
+        counts["deleted"] += deleted
+        counts["failed"] += len(failed_ids)
+        pending.clear()
+
+    index = index_hashes(loader.scan_sorted(page_size=settings.verify_page_size))
+    compared = 0
+    for doc_id, difference in diff_sorted(source, index):
+        compared += 1
+        if compared % 1_000_000 == 0:
+            logger.info(f"Verified {compared} documents of {loader.index_name}...")
+        if difference is None:
+            counts["matched"] += 1
+            continue
+        counts[difference] += 1
+        if len(examples[difference]) < VERIFY_EXAMPLES:
+            examples[difference].append(doc_id)
+        if repair is not None:
+            pending.append(doc_id)
+            if len(pending) >= settings.verify_page_size:
+                flush()
+    if pending:
+        flush()
+
+    for difference, doc_ids in examples.items():
+        if doc_ids:
+            logger.warning(f"{counts[difference]} {difference} documents in {loader.index_name}, e.g. {', '.join(doc_ids)}.")
+    logger.info(
+        f"Verified {loader.index_name}: {counts['matched']} matched, {counts[MISSING]} missing, {counts[STALE]} stale, "
+        f"{counts[ORPHANED]} orphaned; {counts['reindexed']} reindexed, {counts['deleted']} deleted, {counts['failed']} failed."
+    )
+    return counts
+
+def run_verify():
+    """Сверяет movies и производные индексы с Postgres и исправляет только расходящиеся документы.
+
+    Заменяет полную перезагрузку после пропущенных изменений и удаляет документы удалённых записей:
+    инкрементальная загрузка удалений не видит, а удалённые связи персон с фильмами - и в режиме опроса.
+    verify_repair=false оставляет только отчёт.
+    """
+    extractor = PostgresExtractor()
+    loader = ElasticLoader()
+    hash_store = DocumentHashStore() if settings.skip_unchanged else None
+
+    checks = [(
+        loader, EXTRACT_FILMWORK_BY_IDS_QUERY, transform_movies,
+        source_hashes(extractor.stream_partition_documents(MIN_ID, MAX_ID)),
+    )]
+    checks.extend(
+        (target.loader, target.by_ids_query, target.transform, target_hashes(target, extractor))
+        for target in index_targets()
+    )
+    for index_loader, query, transform, source in checks:
+        repair = None
+        if settings.verify_repair:
+            repair = partial(
+                repair_documents, query=query, transform=transform, extractor=extractor, loader=index_loader,
+                hash_store=hash_store,
+            )
+        verify_index(source, index_loader, repair)
+    extractor.close()
+    if hash_store is not None:
+        hash_store.close()
+
 if __name__ == "__main__":
     import sys
     # Опционально: используем аргумент командной строки или переменную окружения
@@ -102,10 +706,29 @@ if __name__ == "__main__":
     # Например: python -m etl.main full_load или MODE=full_load python -m etl.main
     mode = os.getenv("ETL_MODE", "loop") # По умолчанию - цикл
 
+    if settings.apply_migrations:
+        apply_migrations()
+    start_metrics_server()
+
     if mode == "full_load":
         logger.info("Running in 'full_load' mode.")
         run_etl_initial_load()
         logger.info("Exiting after initial load.")
+    elif mode == "listen":
+        logger.info("Running in 'listen' mode.")
+        run_etl_listen()
+    elif mode == "replay_dead_letters":
+        logger.info("Running in 'replay_dead_letters' mode.")
+        run_replay_dead_letters()
+    elif mode == "rebuild_hashes":
+        logger.info("Running in 'rebuild_hashes' mode.")
+        run_rebuild_hashes()
+    elif mode == "verify":
+        logger.info("Running in 'verify' mode.")
+        run_verify()
+    elif settings.async_engine:
+        logger.info("Running in 'loop' mode on the asyncio engine.")
+        asyncio.run(run_async_etl_loop())
     else:
         logger.info("Running in 'loop' mode.")
         run_etl_loop() # Запускаем цикл
@@ -0,0 +1,137 @@
+import cProfile
+import logging
+import pstats
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Этапы: extract (страница или пачка потока из Postgres), transform (transform_movies),
+# bulk (один запрос _bulk), reindex (перестройка фильмов по зависимостям или уведомлениям),
+# assemble (сборка строк из id связей и DimensionCache в режиме dimension_cache)
+STAGE_SECONDS = Histogram(
+    "etl_stage_duration_seconds", "Duration of one ETL stage call.", ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+STAGE_ROWS = Counter("etl_stage_rows_total", "Rows processed by an ETL stage; rate() gives rows per second.", ["stage"])
+BULK_BYTES = Counter("etl_bulk_bytes_total", "Bytes of documents sent in _bulk bodies; rate() gives bytes per second.")
+# indexed - принят, throttled - 429/503 и будет повторён, rejected - в очереди недоставленных,
+# failed - не принят и после всех повторов
+BULK_ITEMS = Counter("etl_bulk_items_total", "Bulk item responses by result.", ["result"])
+# Поиск имён в DimensionCache (режим dimension_cache): для персон - по id, для жанров - по пачке
+DIMENSION_CACHE_LOOKUPS = Counter(
+    "etl_dimension_cache_lookups_total", "Dimension cache lookups by dimension and result.", ["dimension", "result"],
+)
+BACKOFF_RETRIES = Counter("etl_backoff_retries_total", "Retries made by the backoff decorator.", ["function"])
+QUEUE_DEPTH = Gauge("etl_queue_depth", "Items waiting in an internal queue.", ["queue"])
+BATCH_SIZE = Gauge("etl_batch_size", "Current adaptive batch size.", ["name"])
+LAST_PROCESSED_MODIFIED = Gauge(
+    "etl_last_processed_modified_timestamp_seconds", "modified of the last film_work row loaded into Elasticsearch.",
+)
+FRESHNESS_LAG = Gauge(
+    "etl_freshness_lag_seconds",
+    "Now minus modified of the last loaded film_work row, computed at scrape time; 0 after a pass reaches the end of film_work.",
+)
+
+def start_metrics_server():
+    """Отдаёт /metrics на metrics_port (0 - отключено)."""
+    if settings.metrics_port:
+        start_http_server(settings.metrics_port)
+        logger.info(f"Serving Prometheus metrics on port {settings.metrics_port}.")
+
+# Сырые длительности вызовов этапов для бенчмарков (benchmarks/bench_etl.py); None - не собираются
+_stage_samples: Optional[Dict[str, List[float]]] = None
+
+def collect_stage_samples() -> Dict[str, List[float]]:
+    """Начинает заново собирать длительность каждого вызова observe_stage в памяти процесса.
+
+    Возвращает словарь этап -> длительности, который пополняется дальше. Гистограммы Prometheus
+    дают только корзины, а бенчмарку нужны точные перцентили.
+    """
+    global _stage_samples
+    _stage_samples = {}
+    return _stage_samples
+
+def observe_stage(stage: str, seconds: float, rows: int = 0):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    if _stage_samples is not None:
+        # setdefault атомарен: этапы bulk наблюдаются из нескольких потоков
+        _stage_samples.setdefault(stage, []).append(seconds)
+    if rows:
+        STAGE_ROWS.labels(stage).inc(rows)
+
+@contextmanager
+def timed_stage(stage: str, rows: int = 0):
+    started = time.monotonic()
+    yield
+    observe_stage(stage, time.monotonic() - started, rows)
+
+# modified последней загруженной строки (секунды эпохи) и признак, что последний проход дошёл до конца film_work
+_last_modified: Optional[float] = None
+_caught_up = False
+
+def _timestamp(modified: datetime) -> float:
+    """Время без пояса считается UTC."""
+    if modified.tzinfo is None:
+        modified = modified.replace(tzinfo=timezone.utc)
+    return modified.timestamp()
+
+def _freshness_lag() -> float:
+    # Считается при каждом опросе /metrics: при остановке загрузки отставание продолжает расти
+    if _caught_up or _last_modified is None:
+        return 0.0
+    return max(0.0, time.time() - _last_modified)
+
+FRESHNESS_LAG.set_function(_freshness_lag)
+
+def observe_freshness(modified: datetime):
+    """Свежесть индекса по modified последней загруженной строки."""
+    global _last_modified, _caught_up
+    _last_modified = _timestamp(modified)
+    _caught_up = False
+    LAST_PROCESSED_MODIFIED.set(_last_modified)
+
+def mark_caught_up():
+    """Проход дошёл до конца film_work: всё, что есть в Postgres, уже в индексе."""
+    global _caught_up
+    _caught_up = True
+
+def mark_stalled(modified: datetime):
+    """Проход остановился на непринятой строке с этим modified: индекс отстаёт, пока она не загрузится.
+
+    Если процесс ещё ничего не загрузил (например, после перезапуска), отставание отсчитывается от этой строки.
+    """
+    global _last_modified, _caught_up
+    _caught_up = False
+    if _last_modified is None:
+        _last_modified = _timestamp(modified)
+
+_profile_stats: Optional[pstats.Stats] = None
+
+@contextmanager
+def sampled_profile():
+    """Профилирует блок cProfile с вероятностью profile_sample_rate.
+
+    Статистика всех профилированных блоков накапливается и после каждого сохраняется в profile_output
+    (смотреть: python -m pstats <файл>). Без profile_output блок выполняется как есть.
+    """
+    global _profile_stats
+    if not settings.profile_output or random.random() >= settings.profile_sample_rate:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        if _profile_stats is None:
+            _profile_stats = pstats.Stats(profiler)
+        else:
+            _profile_stats.add(profiler)
+        _profile_stats.dump_stats(settings.profile_output)
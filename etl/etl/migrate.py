@@ -0,0 +1,55 @@
+import logging
+import re
+from pathlib import Path
+from typing import Optional
+import psycopg2
+from .utils import backoff
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+# Индекс, который строит миграция: прерванный CREATE INDEX CONCURRENTLY оставляет его невалидным
+CONCURRENT_INDEX = re.compile(r"CREATE INDEX CONCURRENTLY IF NOT EXISTS (\w+) ON (\w+)\.", re.IGNORECASE)
+INDEX_VALID_QUERY = "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)"
+
+def drop_invalid_index(cur, sql: str):
+    """Удаляет невалидный индекс, оставленный прерванной миграцией sql, чтобы она построила его заново.
+
+    IF NOT EXISTS считает такой индекс существующим, а планировщик его не использует.
+    """
+    match = CONCURRENT_INDEX.search(sql)
+    if match is None:
+        return
+    index = f"{match.group(2)}.{match.group(1)}"
+    cur.execute(INDEX_VALID_QUERY, (index,))
+    row = cur.fetchone()
+    if row is not None and not row[0]:
+        logger.warning(f"Index {index} is invalid after an interrupted build, dropping it to rebuild...")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index}")
+
+@backoff
+def apply_migrations(dsn: str = None, listen_triggers: Optional[bool] = None):
+    """Применяет SQL-миграции из etl/migrations по порядку имён.
+
+    Каждый файл выполняется целиком в режиме autocommit, поэтому CREATE INDEX CONCURRENTLY
+    должен быть единственным оператором в своём файле. Миграции идемпотентны (IF NOT EXISTS),
+    невалидный индекс прерванной миграции перед ней удаляется (см. drop_invalid_index).
+    Триггеры режима listen ставятся миграциями из migrations/listen только при listen_triggers
+    (по умолчанию settings.listen_triggers), иначе migrations/listen_off снимает их.
+    """
+    dsn = dsn if dsn is not None else str(settings.postgres_dsn)
+    listen_triggers = listen_triggers if listen_triggers is not None else settings.listen_triggers
+    trigger_dir = MIGRATIONS_DIR / ("listen" if listen_triggers else "listen_off")
+    paths = sorted(MIGRATIONS_DIR.glob("*.sql")) + sorted(trigger_dir.glob("*.sql"))
+    conn = psycopg2.connect(dsn)
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            for path in paths:
+                sql = path.read_text(encoding="utf-8")
+                drop_invalid_index(cur, sql)
+                logger.info(f"Applying migration {path.name}...")
+                cur.execute(sql)
+    finally:
+        conn.close()
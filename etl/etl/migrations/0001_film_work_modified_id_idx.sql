@@ -0,0 +1,2 @@
+-- Индекс под keyset-пагинацию EXTRACT_FILMWORK_QUERY: WHERE (modified, id) > (...) ORDER BY modified, id
+CREATE INDEX CONCURRENTLY IF NOT EXISTS film_work_modified_id_idx ON content.film_work USING btree (modified, id);
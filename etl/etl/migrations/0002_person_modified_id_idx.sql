@@ -0,0 +1,2 @@
+-- Keyset-пагинация изменений персон: WHERE (modified, id) > (...) ORDER BY modified, id
+CREATE INDEX CONCURRENTLY IF NOT EXISTS person_modified_id_idx ON content.person USING btree (modified, id);
@@ -0,0 +1,2 @@
+-- Keyset-пагинация изменений жанров: WHERE (modified, id) > (...) ORDER BY modified, id
+CREATE INDEX CONCURRENTLY IF NOT EXISTS genre_modified_id_idx ON content.genre USING btree (modified, id);
@@ -0,0 +1,2 @@
+-- Поиск фильмов изменённых персон: WHERE person_id = ANY(...) ORDER BY film_work_id
+CREATE INDEX CONCURRENTLY IF NOT EXISTS person_film_work_person_idx ON content.person_film_work USING btree (person_id, film_work_id);
@@ -0,0 +1,2 @@
+-- Поиск фильмов изменённых жанров: WHERE genre_id = ANY(...) ORDER BY film_work_id
+CREATE INDEX CONCURRENTLY IF NOT EXISTS genre_film_work_genre_idx ON content.genre_film_work USING btree (genre_id, film_work_id);
@@ -0,0 +1,2 @@
+-- Keyset-пагинация новых связей персон с фильмами: WHERE (created, id) > (...)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS person_film_work_created_id_idx ON content.person_film_work USING btree (created, id);
@@ -0,0 +1,2 @@
+-- Keyset-пагинация новых связей жанров с фильмами: WHERE (created, id) > (...)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS genre_film_work_created_id_idx ON content.genre_film_work USING btree (created, id);
@@ -0,0 +1,18 @@
+-- Триггерная функция режима listen: сообщает '<таблица>:<id>' в канал etl_changes.
+-- Для фильмов и связующих таблиц передаётся id фильма, для персон и жанров - их собственный id.
+-- Одинаковые уведомления внутри транзакции Postgres схлопывает, а доставляет их только после COMMIT.
+CREATE OR REPLACE FUNCTION content.etl_notify_change() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    changed jsonb;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        changed := to_jsonb(OLD);
+        PERFORM pg_notify('etl_changes', TG_TABLE_NAME || ':' || COALESCE(changed->>'film_work_id', changed->>'id'));
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        changed := to_jsonb(NEW);
+        PERFORM pg_notify('etl_changes', TG_TABLE_NAME || ':' || COALESCE(changed->>'film_work_id', changed->>'id'));
+    END IF;
+    RETURN NULL;
+END;
+$$;
@@ -0,0 +1,19 @@
+-- Триггеры уведомлений на таблицах content.*; в Postgres 13 нет CREATE OR REPLACE TRIGGER, поэтому проверяем pg_trigger
+DO $$
+DECLARE
+    table_name text;
+BEGIN
+    FOREACH table_name IN ARRAY ARRAY['film_work', 'person', 'genre', 'person_film_work', 'genre_film_work'] LOOP
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_trigger
+            WHERE tgname = 'etl_notify_change' AND tgrelid = format('content.%I', table_name)::regclass
+        ) THEN
+            EXECUTE format(
+                'CREATE TRIGGER etl_notify_change AFTER INSERT OR UPDATE OR DELETE ON content.%I '
+                'FOR EACH ROW EXECUTE FUNCTION content.etl_notify_change()',
+                table_name
+            );
+        END IF;
+    END LOOP;
+END;
+$$;
@@ -0,0 +1,23 @@
+-- Связь персоны с фильмом меняет и документ персоны в индексе persons: для person_film_work кроме id фильма
+-- сообщаем 'person_film_work.person_id:<id персоны>'. Так режим listen видит и удаление связи.
+CREATE OR REPLACE FUNCTION content.etl_notify_change() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    changed jsonb;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        changed := to_jsonb(OLD);
+        PERFORM pg_notify('etl_changes', TG_TABLE_NAME || ':' || COALESCE(changed->>'film_work_id', changed->>'id'));
+        IF TG_TABLE_NAME = 'person_film_work' THEN
+            PERFORM pg_notify('etl_changes', 'person_film_work.person_id:' || (changed->>'person_id'));
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        changed := to_jsonb(NEW);
+        PERFORM pg_notify('etl_changes', TG_TABLE_NAME || ':' || COALESCE(changed->>'film_work_id', changed->>'id'));
+        IF TG_TABLE_NAME = 'person_film_work' THEN
+            PERFORM pg_notify('etl_changes', 'person_film_work.person_id:' || (changed->>'person_id'));
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$;
@@ -0,0 +1,17 @@
+-- Режим listen выключен (listen_triggers=false): снимаем триггеры уведомлений с таблиц content.*, чтобы
+-- записи в них не платили за to_jsonb и pg_notify. DROP TRIGGER берёт эксклюзивную блокировку таблицы,
+-- поэтому выполняется только там, где триггер ещё стоит.
+DO $$
+DECLARE
+    table_name text;
+BEGIN
+    FOREACH table_name IN ARRAY ARRAY['film_work', 'person', 'genre', 'person_film_work', 'genre_film_work'] LOOP
+        IF EXISTS (
+            SELECT 1 FROM pg_trigger
+            WHERE tgname = 'etl_notify_change' AND tgrelid = format('content.%I', table_name)::regclass
+        ) THEN
+            EXECUTE format('DROP TRIGGER etl_notify_change ON content.%I', table_name);
+        END IF;
+    END LOOP;
+END;
+$$;
@@ -0,0 +1,2 @@
+-- Триггерная функция режима listen без триггеров не нужна
+DROP FUNCTION IF EXISTS content.etl_notify_change();
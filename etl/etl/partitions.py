@@ -0,0 +1,129 @@
+import logging
+import multiprocessing
+import uuid
+from multiprocessing.connection import wait
+from typing import List, Tuple
+from .extractor import PostgresExtractor
+from .transformer import transform_movies
+from .loader import ElasticLoader, contiguous_handled
+from .state import State
+from .config import settings
+from .metrics import timed_stage
+
+logger = logging.getLogger(__name__)
+
+MIN_ID = "00000000-0000-0000-0000-000000000000"
+MAX_ID = "ffffffff-ffff-ffff-ffff-ffffffffffff"
+
+def partition_bounds(partitions: int) -> List[Tuple[str, str]]:
+    """Делит пространство UUID на равные непересекающиеся диапазоны (after_id, upper_id]."""
+    step = (1 << 128) // partitions
+    bounds = []
+    for number in range(partitions):
+        after_id = MIN_ID if number == 0 else str(uuid.UUID(int=number * step))
+        upper_id = MAX_ID if number == partitions - 1 else str(uuid.UUID(int=(number + 1) * step))
+        bounds.append((after_id, upper_id))
+    return bounds
+
+def partition_state(number: int) -> State:
+    """Отдельный файл состояния на партицию: процессы не перезаписывают ключи друг друга."""
+    return State(f"{settings.state_file_path}.partition-{number}")
+
+def transform_batch(raw_batch):
+    with timed_stage("transform", len(raw_batch)):
+        return transform_movies(raw_batch)
+
+def load_partition(index: str, number: int, after_id: str, upper_id: str):
+    """Извлекает, трансформирует и загружает один диапазон id, сохраняя прогресс после каждой пачки."""
+    logging.basicConfig(level=logging.INFO)
+    state_manager = partition_state(number)
+    if state_manager.get_value('index') != index:
+        # Состояние от другой полной загрузки - начинаем партицию заново
+        state_manager.reset()
+        state_manager.set_value('index', index)
+    if state_manager.get_value('done'):
+        logger.info(f"Partition {number} already loaded into {index}.")
+        return
+
+    last_id = state_manager.get_value('last_id', default=after_id)
+    logger.info(f"Partition {number}: loading ids in ({last_id}, {upper_id}] into {index}...")
+
+    extractor = PostgresExtractor()
+    loader = ElasticLoader()
+    # Метка пачки - id её документов по порядку: контрольная точка сдвигается до последнего принятого подряд
+    if settings.ndjson_fast_path:
+        # Документы уже собраны в Postgres: без словарей и повторной сериализации
+        results = loader.load_ndjson_batches(
+            ((documents, [doc_id for doc_id, _ in documents]) for documents in extractor.stream_partition_documents(last_id, upper_id)),
+            index=index,
+        )
+    else:
+        results = loader.load_batches(
+            ((transform_batch(raw_batch), [str(row['id']) for row in raw_batch]) for raw_batch in extractor.stream_partition(last_id, upper_id)),
+            index=index,
+        )
+    processed = 0
+    try:
+        for ids, outcome in results:
+            handled = contiguous_handled(outcome)
+            if handled:
+                state_manager.set_value('last_id', ids[handled - 1])
+            processed += outcome.count(True)
+            if handled < len(ids):
+                # Партиция будет перезапущена и продолжит с этого документа
+                raise RuntimeError(f"Partition {number}: document {ids[handled]} was not accepted by {index}.")
+    finally:
+        # При одном процессе перезапуск идёт в том же процессе: пул соединений не должен оставаться открытым
+        extractor.close()
+    state_manager.set_value('done', True)
+    logger.info(f"Partition {number} finished, {processed} documents loaded.")
+
+def run_partitioned_load(index: str, workers: int):
+    """Запускает загрузку партиций в отдельных процессах.
+
+    Упавшая партиция перезапускается одна и продолжает со своей контрольной точки - не больше
+    partition_max_restarts раз. Единственная партиция (full_load_workers=1) загружается и перезапускается
+    в этом же процессе.
+    """
+    bounds = partition_bounds(workers)
+    if workers == 1:
+        for attempt in range(settings.partition_max_restarts + 1):
+            try:
+                load_partition(index, 0, *bounds[0])
+                return
+            except Exception as e:
+                if attempt == settings.partition_max_restarts:
+                    raise RuntimeError(f"Partition 0 failed {attempt + 1} times, giving up.") from e
+                logger.warning(f"Partition 0 failed: {e}. Restarting from its checkpoint...")
+
+    # spawn, а не fork: дочерние процессы не должны наследовать сокеты соединений родителя
+    context = multiprocessing.get_context("spawn")
+
+    def start(number: int):
+        process = context.Process(target=load_partition, args=(index, number, *bounds[number]), name=f"partition-{number}")
+        process.start()
+        return process
+
+    restarts = {number: 0 for number in range(workers)}
+    running = {number: start(number) for number in range(workers)}
+    try:
+        while running:
+            wait([process.sentinel for process in running.values()])
+            for number, process in list(running.items()):
+                if process.exitcode is None:
+                    continue
+                del running[number]
+                if process.exitcode == 0:
+                    continue
+                restarts[number] += 1
+                if restarts[number] > settings.partition_max_restarts:
+                    raise RuntimeError(f"Partition {number} failed {restarts[number]} times, giving up.")
+                logger.warning(f"Partition {number} exited with code {process.exitcode}, restarting...")
+                running[number] = start(number)
+    finally:
+        for process in running.values():
+            process.terminate()
+
+def reset_partition_states(workers: int):
+    for number in range(workers):
+        partition_state(number).reset()
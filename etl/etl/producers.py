@@ -0,0 +1,52 @@
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+from .extractor import PostgresExtractor, Cursor, row_cursor
+from .queries import (
+    CHANGED_PERSONS_QUERY, CHANGED_GENRES_QUERY, CHANGED_PERSON_FILM_WORK_QUERY, CHANGED_GENRE_FILM_WORK_QUERY,
+    PERSON_HEAD_QUERY, GENRE_HEAD_QUERY, PERSON_FILM_WORK_HEAD_QUERY, GENRE_FILM_WORK_HEAD_QUERY,
+    PERSON_FILM_IDS_QUERY, GENRE_FILM_IDS_QUERY,
+)
+
+logger = logging.getLogger(__name__)
+
+class DependencyProducer:
+    """Отслеживает изменения зависимой таблицы и находит фильмы, документы которых нужно перестроить.
+
+    Если film_ids_query не задан, строки изменений сами содержат film_work_id (связующие таблицы).
+    """
+
+    def __init__(self, name: str, changes_query: str, head_query: str, film_ids_query: Optional[str] = None):
+        self.name = name
+        self.state_key = f"{name}_cursor"
+        self.changes_query = changes_query
+        self.head_query = head_query
+        self.film_ids_query = film_ids_query
+
+    def next_page(self, extractor: PostgresExtractor,
+                  cursor: Cursor) -> Tuple[Set[str], Optional[Cursor], List[Dict[str, Any]]]:
+        """Читает одну страницу изменений после cursor.
+
+        Возвращает id затронутых фильмов, курсор конца страницы (None, если изменений нет)
+        и сами строки изменений - по ним производные индексы находят свои документы.
+        """
+        changes = extractor.extract_changes(self.changes_query, cursor)
+        if not changes:
+            return set(), None, []
+
+        if self.film_ids_query is None:
+            film_ids = {str(row['film_work_id']) for row in changes}
+        else:
+            changed_ids: List[str] = [str(row['id']) for row in changes]
+            film_ids = set()
+            for batch in extractor.extract_film_ids(self.film_ids_query, changed_ids):
+                film_ids.update(batch)
+
+        logger.info(f"Producer {self.name}: {len(changes)} changes affect {len(film_ids)} films.")
+        return film_ids, row_cursor(changes[-1]), changes
+
+DEPENDENCY_PRODUCERS = [
+    DependencyProducer("person", CHANGED_PERSONS_QUERY, PERSON_HEAD_QUERY, PERSON_FILM_IDS_QUERY),
+    DependencyProducer("genre", CHANGED_GENRES_QUERY, GENRE_HEAD_QUERY, GENRE_FILM_IDS_QUERY),
+    DependencyProducer("person_film_work", CHANGED_PERSON_FILM_WORK_QUERY, PERSON_FILM_WORK_HEAD_QUERY),
+    DependencyProducer("genre_film_work", CHANGED_GENRE_FILM_WORK_QUERY, GENRE_FILM_WORK_HEAD_QUERY),
+]
@@ -1,22 +1,268 @@
-# Запрос для извлечения фильмов, измененных после указанной даты
-EXTRACT_FILMWORK_QUERY = """
+# Символы, которые str.strip() считает пробельными: очистка значений в SQL совпадает с прежней очисткой в Python
+_WHITESPACE = "".join(ch for ch in map(chr, range(0x3001)) if ch.isspace())
+WHITESPACE_SQL = "E'" + "".join(f"\\u{ord(ch):04X}" for ch in _WHITESPACE) + "'"
+
+def clean_text_sql(expression: str) -> str:
+    """SQL-выражение: обрезка пробелов, 'N/A' и 'None' превращаются в NULL."""
+    return f"NULLIF(NULLIF(btrim({expression}, {WHITESPACE_SQL}), 'N/A'), 'None')"
+
+def persons_sql(role: str) -> str:
+    """JSON-массив {id, name} участников фильма с заданной ролью.
+
+    Порядок тот же, что у ARRAY_AGG(DISTINCT id || '###' || full_name); имена, которые нельзя
+    однозначно разделить по '###', пустые и 'N/A'/'None' отбрасываются.
+    """
+    return f"""(
+        SELECT COALESCE(json_agg(json_build_object('id', p.id, 'name', btrim(p.full_name, {WHITESPACE_SQL}))
+                                 ORDER BY p.id || '###' || p.full_name), '[]')
+        FROM content."person_film_work" pfw
+        JOIN content."person" p ON p.id = pfw.person_id
+        WHERE pfw.film_work_id = fw.id AND pfw.role = '{role}'
+          AND {clean_text_sql('p.full_name')} <> '' AND strpos(p.full_name, '###') = 0
+    )"""
+
+GENRES_SQL = f"""ARRAY(
+        SELECT btrim(d.name, {WHITESPACE_SQL})
+        FROM (
+            SELECT DISTINCT g.name
+            FROM content."genre_film_work" gfw
+            JOIN content."genre" g ON g.id = gfw.genre_id
+            WHERE gfw.film_work_id = fw.id
+        ) d
+        WHERE {clean_text_sql('d.name')} IS NOT NULL
+        ORDER BY d.name
+    )"""
+
+# Общая часть запросов: фильм с уже очищенными полями, жанрами (text[]) и участниками (json).
+# Связанные записи выбираются коррелированными подзапросами по индексам film_work_genre_idx и
+# film_work_person_role_idx, без декартова произведения жанров и персон и без GROUP BY.
+# {films} - источник строк film_work: сама таблица или уже отобранная страница.
+FILMWORK_SELECT = """
 SELECT
     fw.id,
-    fw.title,
-    fw.description,
-    fw.rating AS imdb_rating,
+    """ + clean_text_sql("fw.title") + """ AS title,
+    """ + clean_text_sql("fw.description") + """ AS description,
+    CASE WHEN fw.rating IN ('NaN', 'Infinity', '-Infinity') THEN NULL ELSE fw.rating END AS imdb_rating,
     fw.modified AS modified,
-    ARRAY_AGG(DISTINCT g.name) FILTER (WHERE g.name IS NOT NULL) AS genres,
-    ARRAY_AGG(DISTINCT p.id || '###' || p.full_name) FILTER (WHERE pfw.role = 'actor' AND p.full_name IS NOT NULL) AS actors,
-    ARRAY_AGG(DISTINCT p.id || '###' || p.full_name) FILTER (WHERE pfw.role = 'writer' AND p.full_name IS NOT NULL) AS writers,
-    ARRAY_AGG(DISTINCT p.id || '###' || p.full_name) FILTER (WHERE pfw.role = 'director' AND p.full_name IS NOT NULL) AS directors
-FROM content."film_work" fw
-LEFT JOIN content."genre_film_work" gfw ON fw.id = gfw.film_work_id
-LEFT JOIN content."genre" g ON gfw.genre_id = g.id
-LEFT JOIN content."person_film_work" pfw ON fw.id = pfw.film_work_id
-LEFT JOIN content."person" p ON pfw.person_id = p.id
-WHERE fw.modified > %s
-GROUP BY fw.id
-ORDER BY fw.modified
+    """ + GENRES_SQL + """ AS genres,
+    """ + persons_sql("actor") + """ AS actors,
+    """ + persons_sql("writer") + """ AS writers,
+    """ + persons_sql("director") + """ AS directors
+FROM {films} fw
+"""
+
+# Keyset-пагинация по (modified, id): страница сначала отбирается диапазонным сканом
+# индекса film_work_modified_id_idx, и только потом для неё собираются жанры и персоны.
+# Сравнение кортежей не теряет строки с одинаковым modified на границе страниц.
+FILMWORK_PAGE = """(
+    SELECT * FROM content."film_work"
+    WHERE (modified, id) > (%s::timestamp, %s::uuid)
+    ORDER BY modified, id
+    LIMIT %s
+)"""
+EXTRACT_FILMWORK_QUERY = FILMWORK_SELECT.format(films=FILMWORK_PAGE) + """
+ORDER BY fw.modified, fw.id;
+"""
+
+# Поток фильмов одного диапазона id для параллельной полной загрузки: диапазон (%s, %s] читается по первичному ключу.
+# Строки без modified не попадают в индекс, как и при keyset-пагинации по (modified, id).
+STREAM_FILMWORK_PARTITION_QUERY = FILMWORK_SELECT.format(films='content."film_work"') + """
+WHERE fw.id > %s::uuid AND fw.id <= %s::uuid AND fw.modified IS NOT NULL
+ORDER BY fw.id;
+"""
+
+def person_names_sql(persons: str) -> str:
+    """JSON-массив имён из JSON-массива участников с сохранением порядка."""
+    return f"""(
+        SELECT COALESCE(json_agg(e.value->>'name' ORDER BY e.ordinality), '[]')
+        FROM json_array_elements({persons}) WITH ORDINALITY e
+    )"""
+
+# Документ индекса movies целиком собирается в Postgres и отдаётся текстом JSON, готовым для тела _bulk.
+# {films_query} - запрос на основе FILMWORK_SELECT без завершающей точки с запятой.
+DOCUMENT_SELECT = """
+SELECT
+    d.id,
+    json_build_object(
+        'id', d.id,
+        'imdb_rating', d.imdb_rating,
+        'genres', d.genres,
+        'title', d.title,
+        'description', d.description,
+        'directors_names', """ + person_names_sql("d.directors") + """,
+        'actors_names', """ + person_names_sql("d.actors") + """,
+        'writers_names', """ + person_names_sql("d.writers") + """,
+        'directors', d.directors,
+        'actors', d.actors,
+        'writers', d.writers
+    )::text AS document
+FROM ({films_query}) d
+"""
+
+# Поток готовых документов одного диапазона id для быстрой полной загрузки
+STREAM_DOCUMENT_PARTITION_QUERY = DOCUMENT_SELECT.format(
+    films_query=STREAM_FILMWORK_PARTITION_QUERY.strip().rstrip(";"),
+) + """
+ORDER BY d.id;
+"""
+
+# Число фильмов, которые попадают в индекс (строки без modified keyset-пагинация не видит)
+COUNT_FILMWORK_QUERY = """
+SELECT COUNT(*) FROM content."film_work" WHERE modified IS NOT NULL;
+"""
+
+# Полные документы для произвольного набора фильмов (переиндексация по зависимостям)
+EXTRACT_FILMWORK_BY_IDS_QUERY = FILMWORK_SELECT.format(films='content."film_work"') + """
+WHERE fw.id = ANY(%s::uuid[])
+ORDER BY fw.modified, fw.id;
+"""
+
+# --- Режим dimension_cache: в запросе страницы только id связей, имена - из DimensionCache ---
+
+def person_ids_sql(role: str) -> str:
+    """id участников фильма с заданной ролью (text[]) в порядке persons_sql.
+
+    Строки id одной длины с дефисами на одних и тех же местах, поэтому порядок по id совпадает
+    с порядком по p.id || '###' || p.full_name; индекс film_work_person_role_idx покрывает подзапрос.
+    """
+    return f"""ARRAY(
+        SELECT pfw.person_id::text
+        FROM content."person_film_work" pfw
+        WHERE pfw.film_work_id = fw.id AND pfw.role = '{role}'
+        ORDER BY pfw.person_id::text
+    )"""
+
+# Фильм с очищенными полями и id связей вместо жанров и участников: без соединений с genre и person
+FILMWORK_LINKS_SELECT = """
+SELECT
+    fw.id,
+    """ + clean_text_sql("fw.title") + """ AS title,
+    """ + clean_text_sql("fw.description") + """ AS description,
+    CASE WHEN fw.rating IN ('NaN', 'Infinity', '-Infinity') THEN NULL ELSE fw.rating END AS imdb_rating,
+    fw.modified AS modified,
+    ARRAY(
+        SELECT gfw.genre_id::text FROM content."genre_film_work" gfw WHERE gfw.film_work_id = fw.id
+    ) AS genre_ids,
+    """ + person_ids_sql("actor") + """ AS actor_ids,
+    """ + person_ids_sql("writer") + """ AS writer_ids,
+    """ + person_ids_sql("director") + """ AS director_ids
+FROM {films} fw
+"""
+
+EXTRACT_FILMWORK_LINKS_QUERY = FILMWORK_LINKS_SELECT.format(films=FILMWORK_PAGE) + """
+ORDER BY fw.modified, fw.id;
+"""
+
+EXTRACT_FILMWORK_LINKS_BY_IDS_QUERY = FILMWORK_LINKS_SELECT.format(films='content."film_work"') + """
+WHERE fw.id = ANY(%s::uuid[])
+ORDER BY fw.modified, fw.id;
+"""
+
+# Имя персоны в том виде, в каком его отдаёт persons_sql; NULL - персона в документы не попадает
+PERSON_NAMES_QUERY = f"""
+SELECT
+    p.id::text AS id,
+    CASE WHEN {clean_text_sql('p.full_name')} <> '' AND strpos(p.full_name, '###') = 0
+         THEN btrim(p.full_name, {WHITESPACE_SQL}) END AS name
+FROM content."person" p
+WHERE p.id = ANY(%s::uuid[]);
+"""
+
+# Все жанры с местом в порядке ORDER BY d.name из GENRES_SQL (порядок сопоставления базы, а не Python).
+# Жанры с одинаковым исходным названием получают одно место: GENRES_SQL схлопывает их через DISTINCT
+GENRE_NAMES_QUERY = f"""
+SELECT
+    g.id::text AS id,
+    btrim(g.name, {WHITESPACE_SQL}) AS name,
+    {clean_text_sql('g.name')} IS NOT NULL AS valid,
+    dense_rank() OVER (ORDER BY g.name) AS position
+FROM content."genre" g;
+"""
+
+# Страница изменений зависимой таблицы по keyset-курсору ({modified} - колонка времени изменения)
+CHANGES_QUERY_TEMPLATE = """
+SELECT id, {modified} AS modified{columns}
+FROM content."{table}"
+WHERE ({modified}, id) > (%s::timestamp, %s::uuid)
+ORDER BY {modified}, id
+LIMIT %s;
+"""
+
+# Последняя запись таблицы: с неё начинают отслеживание изменений после полной загрузки
+HEAD_QUERY_TEMPLATE = """
+SELECT id, {modified} AS modified
+FROM content."{table}"
+WHERE {modified} IS NOT NULL
+ORDER BY {modified} DESC, id DESC
+LIMIT 1;
+"""
+
+# Фильмы, связанные с изменёнными персонами/жанрами; keyset по film_work_id, чтобы разбивать большой fan-out
+FILM_IDS_QUERY_TEMPLATE = """
+SELECT DISTINCT film_work_id
+FROM content."{table}"
+WHERE {column} = ANY(%s::uuid[]) AND film_work_id > %s::uuid
+ORDER BY film_work_id
+LIMIT %s;
+"""
+
+CHANGED_PERSONS_QUERY = CHANGES_QUERY_TEMPLATE.format(table="person", modified="modified", columns="")
+CHANGED_GENRES_QUERY = CHANGES_QUERY_TEMPLATE.format(table="genre", modified="modified", columns="")
+# В связующих таблицах нет modified, новые связи отслеживаем по created.
+# person_id нужен индексу persons: по этим же строкам перестраиваются документы персон
+CHANGED_PERSON_FILM_WORK_QUERY = CHANGES_QUERY_TEMPLATE.format(table="person_film_work", modified="created", columns=", film_work_id, person_id")
+CHANGED_GENRE_FILM_WORK_QUERY = CHANGES_QUERY_TEMPLATE.format(table="genre_film_work", modified="created", columns=", film_work_id")
+
+FILM_WORK_HEAD_QUERY = HEAD_QUERY_TEMPLATE.format(table="film_work", modified="modified")
+PERSON_HEAD_QUERY = HEAD_QUERY_TEMPLATE.format(table="person", modified="modified")
+GENRE_HEAD_QUERY = HEAD_QUERY_TEMPLATE.format(table="genre", modified="modified")
+PERSON_FILM_WORK_HEAD_QUERY = HEAD_QUERY_TEMPLATE.format(table="person_film_work", modified="created")
+GENRE_FILM_WORK_HEAD_QUERY = HEAD_QUERY_TEMPLATE.format(table="genre_film_work", modified="created")
+
+PERSON_FILM_IDS_QUERY = FILM_IDS_QUERY_TEMPLATE.format(table="person_film_work", column="person_id")
+GENRE_FILM_IDS_QUERY = FILM_IDS_QUERY_TEMPLATE.format(table="genre_film_work", column="genre_id")
+
+# --- Производные индексы genres и persons ---
+
+GENRE_SELECT = """
+SELECT
+    g.id,
+    btrim(g.name, """ + WHITESPACE_SQL + """) AS name,
+    """ + clean_text_sql("g.description") + """ AS description
+FROM content."genre" g
+WHERE """ + clean_text_sql("g.name") + """ IS NOT NULL
+"""
+
+# Персона со списком фильмов и ролей в каждом; фильмы персоны выбираются по person_film_work_person_idx
+PERSON_SELECT = """
+SELECT
+    p.id,
+    btrim(p.full_name, """ + WHITESPACE_SQL + """) AS full_name,
+    (
+        SELECT COALESCE(json_agg(json_build_object('id', f.film_work_id, 'roles', f.roles) ORDER BY f.film_work_id), '[]')
+        FROM (
+            SELECT pfw.film_work_id, array_agg(DISTINCT pfw.role ORDER BY pfw.role) AS roles
+            FROM content."person_film_work" pfw
+            WHERE pfw.person_id = p.id
+            GROUP BY pfw.film_work_id
+        ) f
+    ) AS films
+FROM content."person" p
+WHERE """ + clean_text_sql("p.full_name") + """ IS NOT NULL
+"""
+
+# Документы по id (переиндексация по изменениям) и страницы по id (полная перестройка индекса)
+GENRES_BY_IDS_QUERY = GENRE_SELECT + """AND g.id = ANY(%s::uuid[])
+ORDER BY g.id;
+"""
+GENRES_PAGE_QUERY = GENRE_SELECT + """AND g.id > %s::uuid
+ORDER BY g.id
+LIMIT %s;
+"""
+PERSONS_BY_IDS_QUERY = PERSON_SELECT + """AND p.id = ANY(%s::uuid[])
+ORDER BY p.id;
+"""
+PERSONS_PAGE_QUERY = PERSON_SELECT + """AND p.id > %s::uuid
+ORDER BY p.id
 LIMIT %s;
 """
@@ -1,11 +1,20 @@
 import json
 import os
 import logging
-from typing import Optional
+import tempfile
+from typing import Any, Dict, Optional, Tuple
 from .config import settings
 
 logger = logging.getLogger(__name__)
 
+def _fsync_directory(directory: str):
+    """fsync каталога, чтобы rename или удаление файла пережили отключение питания."""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
 class State:
     def __init__(self, state_file_path: str = None):
         # Используем путь из конфига, если не передан явно
@@ -14,28 +23,55 @@ class State:
         self._state = self._load_state()
 
     def _load_state(self) -> dict:
-        if os.path.exists(self.state_file_path):
-            try:
-                with open(self.state_file_path, 'r') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, IOError) as e:
-                # Используем logger.error для записи ошибки
-                logger.error(f"Error loading state file {self.state_file_path}, starting fresh. Error: {e}")
-                return {}
-        return {}
+        if not os.path.exists(self.state_file_path):
+            return {}
+        try:
+            with open(self.state_file_path, 'r') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            # Пустое состояние означает загрузку всего с 1900 года - это решение оператора, а не ETL
+            raise RuntimeError(
+                f"State file {self.state_file_path} is corrupted: {e}. "
+                f"Restore or remove it explicitly to start from scratch."
+            ) from e
 
     def save_state(self):
+        """Атомарная запись: временный файл с fsync, os.replace поверх старого и fsync каталога.
+
+        После сбоя на диске остаётся либо прежнее, либо новое состояние целиком.
+        Ошибка записи пробрасывается: продолжать без сохранённого курсора нельзя.
+        """
+        directory = os.path.dirname(os.path.abspath(self.state_file_path))
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(self.state_file_path) + ".", suffix=".tmp", dir=directory)
         try:
-            with open(self.state_file_path, 'w') as f:
+            with os.fdopen(fd, 'w') as f:
                 json.dump(self._state, f)
-        except IOError as e:
-            # Используем logger.error для записи ошибки
-            logger.error(f"Error saving state to file {self.state_file_path}: {e}")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.state_file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        _fsync_directory(directory)
+
+    def reset(self):
+        """Очищает состояние и удаляет его файл."""
+        self._state = {}
+        if os.path.exists(self.state_file_path):
+            os.remove(self.state_file_path)
+            _fsync_directory(os.path.dirname(os.path.abspath(self.state_file_path)))
+            logger.info(f"State file {self.state_file_path} removed.")
 
     def set_value(self, key: str, value):
         self._state[key] = value
         self.save_state()
 
+    def set_values(self, values: Dict[str, Any]):
+        """Записывает несколько ключей одной атомарной записью."""
+        self._state.update(values)
+        self.save_state()
+
     def get_value(self, key: str, default=None):
 
         return self._state.get(key, default)
@@ -45,4 +81,21 @@ class State:
 
     def set_last_modified(self, value):
         self.set_value('last_processed_modified', value)
+
+    def get_cursor(self, key: str, default: Optional[Tuple[str, str]] = None) -> Optional[Tuple[str, str]]:
+        """Возвращает курсор keyset-пагинации (modified, id), сохранённый под ключом key."""
+        value = self.get_value(key)
+        if value is None:
+            return default
+        return value['modified'], value['id']
+
+    def set_cursor(self, key: str, cursor: Tuple[str, str]):
+        self.set_cursors({key: cursor})
+
+    def set_cursors(self, cursors: Dict[str, Tuple[str, str]], values: Optional[Dict[str, Any]] = None):
+        """Сохраняет несколько курсоров (и, при необходимости, других ключей) одной записью:
+        после сбоя сдвинуты либо все, либо ни один."""
+        update = dict(values or {})
+        update.update({key: {'modified': modified, 'id': id_} for key, (modified, id_) in cursors.items()})
+        self.set_values(update)
     # --- Конец добавленных методов ---
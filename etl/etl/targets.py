@@ -0,0 +1,70 @@
+from typing import Any, Callable, Dict, List, Set
+from .config import settings
+from .index_mapping import GENRES_INDEX_MAPPING_BODY, PERSONS_INDEX_MAPPING_BODY
+from .loader import ElasticLoader
+from .queries import GENRES_BY_IDS_QUERY, GENRES_PAGE_QUERY, PERSONS_BY_IDS_QUERY, PERSONS_PAGE_QUERY
+from .transformer import transform_genres, transform_persons
+
+def column_notification(table: str, column: str) -> str:
+    """Ключ уведомления с колонкой связующей таблицы, например 'person_film_work.person_id'."""
+    return f"{table}.{column}"
+
+class IndexTarget:
+    """Производный индекс, который обновляется из тех же изменений, что и movies.
+
+    Своего прохода по Postgres у него нет: sources сопоставляет продюсеру зависимой таблицы колонку
+    строк его изменений, в которой лежит id документа этого индекса. Страница изменений, уже прочитанная
+    для movies, сразу даёт id документов, которые нужно перестроить. Документы собираются запросом
+    by_ids_query и функцией transform и загружаются собственным ElasticLoader со своим маппингом.
+    page_query отдаёт все документы страницами по id - для полной перестройки индекса.
+    """
+
+    def __init__(self, name: str, index_name: str, mapping: Dict[str, Any], by_ids_query: str, page_query: str,
+                 transform: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]], sources: Dict[str, str]):
+        self.name = name
+        self.by_ids_query = by_ids_query
+        self.page_query = page_query
+        self.transform = transform
+        self.sources = sources
+        self.loader = ElasticLoader(index_name, mapping)
+
+    @property
+    def index_name(self) -> str:
+        return self.loader.index_name
+
+    def affected_ids(self, changes: Dict[str, List[Dict[str, Any]]]) -> Set[str]:
+        """id документов, затронутых страницами изменений продюсеров (имя продюсера -> строки страницы)."""
+        ids: Set[str] = set()
+        for producer_name, column in self.sources.items():
+            ids.update(str(row[column]) for row in changes.get(producer_name, ()))
+        return ids
+
+    def notified_ids(self, changes: Dict[str, Set[str]]) -> Set[str]:
+        """id документов из уведомлений режима listen (ключ уведомления -> id).
+
+        Для персон и жанров уведомление несёт собственный id строки. Связующая таблица сообщает id фильма,
+        а нужную колонку - отдельным уведомлением '<таблица>.<колонка>' (миграция listen/0010, пока только person_id).
+        """
+        ids: Set[str] = set()
+        for table, column in self.sources.items():
+            ids |= changes.get(table if column == "id" else column_notification(table, column), set())
+        return ids
+
+def index_targets() -> List[IndexTarget]:
+    """Производные индексы из настройки extra_indices в её порядке."""
+    available = {
+        "genres": lambda: IndexTarget(
+            "genres", settings.genres_index, GENRES_INDEX_MAPPING_BODY, GENRES_BY_IDS_QUERY, GENRES_PAGE_QUERY,
+            transform_genres, {"genre": "id"},
+        ),
+        # Документ персоны перестраивается и при смене имени, и при новой связи с фильмом
+        "persons": lambda: IndexTarget(
+            "persons", settings.persons_index, PERSONS_INDEX_MAPPING_BODY, PERSONS_BY_IDS_QUERY, PERSONS_PAGE_QUERY,
+            transform_persons, {"person": "id", "person_film_work": "person_id"},
+        ),
+    }
+    names = [name.strip() for name in settings.extra_indices.split(",") if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ValueError(f"Unknown extra indices: {', '.join(unknown)}. Available: {', '.join(available)}.")
+    return [available[name]() for name in names]
@@ -1,95 +1,47 @@
-from typing import List, Dict, Any, Optional
+from operator import itemgetter
+from typing import List, Dict, Any
 
-def clean_value(value: Any) -> Optional[str]:
-    """Очищает значение: приводит к строке и заменяет 'N/A' и 'None' на None."""
-    if value is None:
-        return None
-    if isinstance(value, str):
-        if value.strip() == "N/A" or value.strip() == "None":
-            return None
-        return value.strip()
-    # Если значение не строка, попробуем привести к строке
-    try:
-        str_val = str(value)
-        if str_val.strip() == "N/A" or str_val.strip() == "None":
-            return None
-        return str_val.strip()
-    except:
-        return None
-
-def parse_person_list(raw_list: Any) -> List[Dict[str, str]]:
-    """Парсит список персонажей из формата 'id###name'. Возвращает список словарей."""
-    # Убедимся, что raw_list - это список
-    if not raw_list or not isinstance(raw_list, list):
-        return []
-
-    persons = []
-    for item in raw_list:
-        # Проверим, что элемент - строка
-        if not item or not isinstance(item, str):
-            continue
-        item_str = clean_value(item)
-        if not item_str:
-            continue
-        parts = item_str.split("###", 2)
-        if len(parts) == 2:
-            pid, name = parts
-            name_clean = clean_value(name)
-            if name_clean:  # Только если имя не N/A, не 'None' и не пустое
-                persons.append({"id": pid.strip(), "name": name_clean})
-    return persons
+_person_name = itemgetter("name")
 
 def transform_movies(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Собирает документы индекса movies из строк FILMWORK_SELECT.
+
+    Очистка 'N/A'/'None', обрезка пробелов и разбор персон выполняются в SQL: title и description
+    уже очищены, genres - список строк, участники - списки {"id", "name"} (декодированный json).
+    Здесь остаётся только собрать документ и выписать имена участников.
+    """
     movies = []
+    append = movies.append
     for row in rows:
-        # Парсим персонажей
-        # parse_person_list гарантирует возврат списка
-        actors = parse_person_list(row.get("actors"))
-        writers = parse_person_list(row.get("writers"))
-        directors = parse_person_list(row.get("directors"))
-
-        # Обрабатываем жанры: оставляем только не-null, не-N/A, не-'None' строки
-        genres_raw = row.get("genres") or []
-        genres = []
-        for g in genres_raw:
-            g_clean = clean_value(g)
-            if g_clean is not None:
-                genres.append(g_clean)
-
-        # Очищаем title и description
-        title = clean_value(row.get("title"))
-        description = clean_value(row.get("description"))
-
-        # imdb_rating: преобразуем в float, если возможно, иначе None
-        imdb_rating = None
-        rating_val = row.get("imdb_rating")
-        if rating_val is not None:
-            # Проверим, может ли строка быть преобразована в float
-            try:
-                # Явно приведем к float, если возможно
-                val = float(rating_val)
-                # Убедимся, что значение не NaN и не infinity
-                if not (val != val or val == float('inf') or val == float('-inf')):
-                    imdb_rating = val
-            except (ValueError, TypeError):
-                # Если не получилось, оставим None
-                imdb_rating = None
-
-        # Формируем итоговый документ
-        movie = {
+        directors = row["directors"]
+        actors = row["actors"]
+        writers = row["writers"]
+        append({
             "id": str(row["id"]),  #id строка
-            "imdb_rating": imdb_rating,
-            "genres": genres, # genres - всегда список строк
-            "title": title,
-            "description": description,
-            "directors_names": [p["name"] for p in directors], # directors_names - всегда список строк
-            "actors_names": [p["name"] for p in actors], # actors_names - всегда список строк
-            "writers_names": [p["name"] for p in writers], # writers_names - всегда список строк
+            "imdb_rating": row["imdb_rating"],
+            "genres": row["genres"], # genres - всегда список строк
+            "title": row["title"],
+            "description": row["description"],
+            "directors_names": list(map(_person_name, directors)), # *_names - всегда список строк
+            "actors_names": list(map(_person_name, actors)),
+            "writers_names": list(map(_person_name, writers)),
             "directors": directors, # directors - всегда список объектов {"id": "...", "name": "..."}
-            "actors": actors, # actors - всегда список объектов {"id": "...", "name": "..."}
-            "writers": writers, # writers - всегда список объектов {"id": "...", "name": "..."}
-        }
-
-        movies.append(movie)
-
-    return movies
\ No newline at end of file
+            "actors": actors,
+            "writers": writers,
+        })
+
+    return movies
+
+def transform_genres(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Документы индекса genres из строк GENRE_SELECT (название и описание уже очищены в SQL)."""
+    return [
+        {"id": str(row["id"]), "name": row["name"], "description": row["description"]}
+        for row in rows
+    ]
+
+def transform_persons(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Документы индекса persons из строк PERSON_SELECT: films - список {"id", "roles"} (декодированный json)."""
+    return [
+        {"id": str(row["id"]), "full_name": row["full_name"], "films": row["films"]}
+        for row in rows
+    ]
@@ -1,13 +1,18 @@
 # etl/utils.py
+import asyncio
 import time
 import logging
 from functools import wraps
 from typing import Callable, Any
+from .metrics import BACKOFF_RETRIES
 
 logger = logging.getLogger(__name__)
 
 def backoff(func: Callable) -> Callable:
 
+    if asyncio.iscoroutinefunction(func):
+        return _async_backoff(func)
+
     @wraps(func)
     def wrapper(*args, **kwargs):
         max_retries = 5  # Максимальное количество попыток
@@ -25,5 +30,26 @@ def backoff(func: Callable) -> Callable:
                 delay = base_delay * (2 ** attempt)
                 # Логируем ошибку с именем функции
                 logger.warning(f"Error in {func.__name__}: {e}. Retrying in {delay}s...")
+                BACKOFF_RETRIES.labels(func.__name__).inc()
                 time.sleep(delay)  # Ждем перед следующей попыткой
+    return wrapper
+
+def _async_backoff(func: Callable) -> Callable:
+    """Тот же backoff для корутин: ожидание через asyncio.sleep не блокирует цикл событий."""
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        max_retries = 5
+        base_delay = 1
+        for attempt in range(max_retries):
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                if attempt == max_retries - 1:
+                    logger.error(f"Max retries reached for {func.__name__}: {e}")
+                    raise e
+                delay = base_delay * (2 ** attempt)
+                logger.warning(f"Error in {func.__name__}: {e}. Retrying in {delay}s...")
+                BACKOFF_RETRIES.labels(func.__name__).inc()
+                await asyncio.sleep(delay)
     return wrapper
\ No newline at end of file
@@ -0,0 +1,67 @@
+"""Сверка индексов с Postgres (режим ETL_MODE=verify).
+
+Обе стороны читаются потоком в порядке id. Postgres отдаёт документы movies серверным курсором
+(как при быстрой полной загрузке), документы производных индексов - страницами по id.
+Elasticsearch читается через point in time с search_after по полю id.
+Потоки сливаются как два отсортированных списка, поэтому память не зависит от размера каталога.
+Документы сравниваются по document_hash - тому же хешу, что хранит DocumentHashStore.
+"""
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import orjson
+from .hash_store import document_hash
+
+# Виды расхождений: фильм есть в Postgres, но не в индексе; документ в индексе отличается от Postgres;
+# документ есть в индексе, а фильма в Postgres нет (удалён)
+MISSING = "missing"
+STALE = "stale"
+ORPHANED = "orphaned"
+
+IdHash = Tuple[str, bytes]
+
+def source_hashes(batches: Iterable[List[Tuple[str, str]]]) -> Iterator[IdHash]:
+    """(id, хеш) из пачек пар (id, документ в виде текста JSON), например PostgresExtractor.stream_partition_documents."""
+    for rows in batches:
+        for doc_id, document in rows:
+            yield str(doc_id), document_hash(orjson.loads(document))
+
+def document_hashes(batches: Iterable[List[Dict[str, Any]]]) -> Iterator[IdHash]:
+    """(id, хеш) из пачек готовых документов, например документов производного индекса по страницам id."""
+    for documents in batches:
+        for doc in documents:
+            yield doc["id"], document_hash(doc)
+
+def index_hashes(pages: Iterable[List[Tuple[str, Dict[str, Any]]]]) -> Iterator[IdHash]:
+    """(id, хеш) из страниц пар (id, _source), например ElasticLoader.scan_sorted."""
+    for hits in pages:
+        for doc_id, source in hits:
+            yield doc_id, document_hash(source)
+
+def _ordered(pairs: Iterator[IdHash], side: str) -> Iterator[IdHash]:
+    last_id = None
+    for doc_id, digest in pairs:
+        if last_id is not None and doc_id <= last_id:
+            raise RuntimeError(f"{side} stream is not ordered by id: {doc_id} after {last_id}.")
+        last_id = doc_id
+        yield doc_id, digest
+
+def diff_sorted(source: Iterable[IdHash], index: Iterable[IdHash]) -> Iterator[Tuple[str, Optional[str]]]:
+    """Сливает потоки (id, хеш) Postgres и индекса; для каждого id отдаёт вид расхождения или None, если документы совпадают.
+
+    Оба потока должны идти по возрастанию id: слияние неупорядоченных потоков приняло бы существующие
+    документы за удалённые, поэтому нарушение порядка прерывает сверку.
+    """
+    source = _ordered(iter(source), "Postgres")
+    index = _ordered(iter(index), "Index")
+    left = next(source, None)
+    right = next(index, None)
+    while left is not None or right is not None:
+        if right is None or (left is not None and left[0] < right[0]):
+            yield left[0], MISSING
+            left = next(source, None)
+        elif left is None or right[0] < left[0]:
+            yield right[0], ORPHANED
+            right = next(index, None)
+        else:
+            yield left[0], None if left[1] == right[1] else STALE
+            left = next(source, None)
+            right = next(index, None)